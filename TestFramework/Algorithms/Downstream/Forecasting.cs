@@ -1,5 +1,7 @@
-﻿using System.Diagnostics;
+﻿using System;
+using System.Diagnostics;
 using CleanIMP.Utilities;
+using CleanIMP.Utilities.Interop;
 using CleanIMP.Utilities.Mathematical;
 using MathNet.Numerics.LinearAlgebra;
 
@@ -28,38 +30,31 @@ public static class Forecasting
         
         // step 2 - run
         long runtime;
+        DownstreamTimings? timings;
         
         if (forecastAlgorithm.StartsWith("darts-"))
         {
-            forecastAlgorithm = forecastAlgorithm.Substring(forecastAlgorithm.IndexOf('-') + 1);//strip the prefix
-            runtime = LaunchDarts(forecastAlgorithm, season, rowsToForecast, slot);
+            string dartsAlgorithm = forecastAlgorithm.Substring(forecastAlgorithm.IndexOf('-') + 1);//strip the prefix
+            (runtime, timings) = Launch("prediction_darts.py", dartsAlgorithm, season, rowsToForecast, slot);
         }
         else
         {
-            runtime = LaunchSktime(forecastAlgorithm, season, rowsToForecast, slot);
+            (runtime, timings) = Launch("prediction.py", forecastAlgorithm, season, rowsToForecast, slot);
         }
+        DownstreamTimings.Record(slot, forecastAlgorithm, timings);
 
         Vector<double> output = MathX.LoadVectorFile(resultFile, rowsToForecast);
         return (runtime, output);
     }
 
-    private static long LaunchSktime(string forecastAlgorithm, int season, int rowsToForecast, int slot)
+    private static (long, DownstreamTimings?) Launch(string script, string forecastAlgorithm, int season, int rowsToForecast, int slot)
     {
         Stopwatch sw = new();
         sw.Start();
-        Utils.RunVoidProcess(Utils.PythonExec, $"prediction.py {forecastAlgorithm} {rowsToForecast} {season} {slot}", SkTimeLocation);
+        (string[] output, DownstreamTimings? timings) = DownstreamTimings.SplitTrailer(PythonScriptWorker.RunScript(script, $"{forecastAlgorithm} {rowsToForecast} {season} {slot}", SkTimeLocation));
         sw.Stop();
         
-        return (long)(sw.Elapsed.TotalMilliseconds * 1000);
-    }
-
-    private static long LaunchDarts(string forecastAlgorithm, int season, int rowsToForecast, int slot)
-    {
-        Stopwatch sw = new();
-        sw.Start();
-        Utils.RunVoidProcess(Utils.PythonExec, $"prediction_darts.py {forecastAlgorithm} {rowsToForecast} {season} {slot}", SkTimeLocation);
-        sw.Stop();
-        
-        return (long)(sw.Elapsed.TotalMilliseconds * 1000);
+        Array.ForEach(output, Console.WriteLine);
+        return ((long)(sw.Elapsed.TotalMilliseconds * 1000), timings);
     }
 }
\ No newline at end of file
@@ -1,8 +1,10 @@
 ﻿using System;
+using System.Collections.Generic;
 using System.Diagnostics;
 using System.Linq;
 using CleanIMP.Testing;
 using CleanIMP.Utilities;
+using CleanIMP.Utilities.Interop;
 
 namespace CleanIMP.Algorithms.Downstream;
 
@@ -31,9 +33,11 @@ public static class MultivariateClassification
         // step 2 - run
         Stopwatch sw = new();
         sw.Start();
-        string[] output = Utils.RunOutputProcess(Utils.PythonExec, $"classify.py {classificationAlgorithm} {slot}", SkTimeLocation).ToArray();
+        (string[] output, DownstreamTimings? timings) = DownstreamTimings.SplitTrailer(PythonScriptWorker.RunScript("classify.py", $"{classificationAlgorithm} {slot}", SkTimeLocation));
         sw.Stop();
 
+        DownstreamTimings.Record(slot, classificationAlgorithm, timings);
+
         if (output.Length == 0 || output.All(String.IsNullOrEmpty))
         {
             throw new ApplicationException("Classifier has not returned a valid classification (0 entries), aborting further execution.");
@@ -41,4 +45,17 @@ public static class MultivariateClassification
 
         return ((long)(sw.Elapsed.TotalMilliseconds * 1000), output);
     }
+
+    public static Dictionary<string, (long, string[])> RunClassifications(MultivarDataset dataset, IReadOnlyList<string> classificationAlgorithms, int slot = 0)
+    {
+        // step 1 - store data
+        string trainFile = SkTimeLocation + DataFolder + $"dataset_TRAIN_{slot}.ts";
+        string testFile = SkTimeLocation + DataFolder + $"dataset_TEST_{slot}.ts";
+
+        dataset.Headers.Concat(dataset.Train.Select(x => x.ToSkTimeLine())).FileWriteAllLines(trainFile);
+        dataset.Headers.Concat(dataset.Test.Select(x => x.ToSkTimeLine())).FileWriteAllLines(testFile);
+
+        // step 2 - run all classifiers on the data loaded once
+        return UnivariateClassification.RunClassificationBatch(classificationAlgorithms, slot);
+    }
 }
\ No newline at end of file
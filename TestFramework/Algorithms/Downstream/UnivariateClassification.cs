@@ -1,9 +1,12 @@
 ﻿using System;
 using System.Collections.Generic;
 using System.Diagnostics;
+using System.IO;
 using System.Linq;
+using System.Text.Json;
 using CleanIMP.Testing;
 using CleanIMP.Utilities;
+using CleanIMP.Utilities.Interop;
 
 namespace CleanIMP.Algorithms.Downstream;
 
@@ -34,9 +37,11 @@ public static class UnivariateClassification
         // step 2 - run
         
         sw.Start();
-        string[] output = Utils.RunOutputProcess(Utils.PythonExec, $"classify.py {classificationAlgorithm} {slot}", SkTimeLocation).ToArray();
+        (string[] output, DownstreamTimings? timings) = DownstreamTimings.SplitTrailer(PythonScriptWorker.RunScript("classify.py", $"{classificationAlgorithm} {slot}", SkTimeLocation));
         sw.Stop();
 
+        DownstreamTimings.Record(slot, classificationAlgorithm, timings);
+
         if (output.Length == 0 || output.All(String.IsNullOrEmpty))
         {
             throw new ApplicationException("Classifier has not returned a valid classification (0 entries), aborting further execution.");
@@ -44,4 +49,56 @@ public static class UnivariateClassification
 
         return ((long)(sw.Elapsed.TotalMilliseconds * 1000), output);
     }
+
+    public static Dictionary<string, (long, string[])> RunClassifications(List<string> headers, UnivarDataset dataset, IReadOnlyList<string> classificationAlgorithms, int slot = 0)
+    {
+        // step 1 - store data
+        string trainFile = SkTimeLocation + DataFolder + $"dataset_TRAIN_{slot}.ts";
+        string testFile = SkTimeLocation + DataFolder + $"dataset_TEST_{slot}.ts";
+
+        headers.Concat(dataset.Train.Select(x => x.ToSkTimeLine())).FileWriteAllLines(trainFile);
+        headers.Concat(dataset.Test.Select(x => x.ToSkTimeLine())).FileWriteAllLines(testFile);
+
+        // step 2 - run all classifiers on the data loaded once
+        return RunClassificationBatch(classificationAlgorithms, slot);
+    }
+
+    /// <summary>
+    /// Runs classify.py once in batch mode on the dataset files of the slot.
+    /// The runtime of each classifier covers its fit and predict, not the load shared by the batch.
+    /// </summary>
+    internal static Dictionary<string, (long, string[])> RunClassificationBatch(IReadOnlyList<string> classificationAlgorithms, int slot)
+    {
+        string manifestFile = DataFolder + $"batch_{slot}.json";
+        string outputFolder = DataFolder + $"batch_{slot}/";
+
+        if (Directory.Exists(SkTimeLocation + outputFolder))
+        {
+            Directory.Delete(SkTimeLocation + outputFolder, true);
+        }
+        File.WriteAllText(SkTimeLocation + manifestFile, JsonSerializer.Serialize(new { classifiers = classificationAlgorithms, output = outputFolder }));
+
+        foreach (string line in PythonScriptWorker.RunScript("classify.py", $"{manifestFile} {slot}", SkTimeLocation))
+        {
+            Console.WriteLine(line);
+        }
+
+        Dictionary<string, (long, string[])> results = new();
+
+        foreach (string classificationAlgorithm in classificationAlgorithms)
+        {
+            string resultFile = SkTimeLocation + outputFolder + classificationAlgorithm;
+            string[] output = File.Exists(resultFile + ".txt") ? TestIOHelpers.LoadClasses(resultFile + ".txt") : Array.Empty<string>();
+
+            if (output.Length == 0)
+            {
+                throw new ApplicationException($"Classifier {classificationAlgorithm} has not returned a valid classification (0 entries), aborting further execution.");
+            }
+
+            results.Add(classificationAlgorithm, (Int64.Parse(File.ReadAllText(resultFile + ".runtime")), output));
+            DownstreamTimings.Record(slot, classificationAlgorithm, File.Exists(resultFile + ".timings") ? DownstreamTimings.Parse(File.ReadAllText(resultFile + ".timings")) : null);
+        }
+
+        return results;
+    }
 }
\ No newline at end of file
@@ -6,6 +6,7 @@ using MathNet.Numerics.LinearAlgebra;
 
 using CleanIMP.Testing;
 using CleanIMP.Utilities;
+using CleanIMP.Utilities.Interop;
 using CleanIMP.Utilities.Mathematical;
 
 namespace CleanIMP.Algorithms.Imputation;
@@ -56,6 +57,12 @@ public abstract class Algorithm
     protected const int ParallelNone = 0;
     protected const int ParallelFull = 1;
 
+    /// <summary>
+    /// Returns and forgets the instrumentation of the recoveries done by the current thread since the last call,
+    /// null for algorithms that are not instrumented (only IIM with the "i" flag is).
+    /// </summary>
+    public virtual IReadOnlyList<ImputeRecovery>? TakeInstrumentation() => null;
+
     // functions
     public void RecoverDataset(MultivarDataset dataset)
     {
@@ -363,16 +370,20 @@ public static class AlgorithmFactory
         string[] paramList = parameters.Split('|');
 
         int n = 3;
+        string flags = "";
         
         foreach (string param in paramList)
         {
             if (param.StartsWith("n"))
             {
-                n = Int32.Parse(param[1..]);
+                // n5 = 5 neighbors; trailing letters are IIM flags, e.g. n5a = adaptive, n5ap4 = adaptive over 4 processes
+                int digits = param[1..].TakeWhile(Char.IsDigit).Count();
+                n = Int32.Parse(param[1..(digits + 1)]);
+                flags = param[(digits + 1)..];
             }
         }
 
-        return new IIMAlgorithm(n);
+        return new IIMAlgorithm(n, flags);
     }
 
     private static Algorithm KNNFactory(string parameters)
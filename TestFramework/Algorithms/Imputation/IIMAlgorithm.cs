@@ -1,4 +1,8 @@
-﻿using CleanIMP.Utilities.Interop;
+﻿using System;
+using System.Collections.Concurrent;
+using System.Collections.Generic;
+using System.Linq;
+using CleanIMP.Utilities.Interop;
 using MathNet.Numerics.LinearAlgebra;
 
 namespace CleanIMP.Algorithms.Imputation;
@@ -6,20 +10,37 @@ namespace CleanIMP.Algorithms.Imputation;
 public sealed class IIMAlgorithm : Algorithm
 {
     public override string AlgCodeBase => "IIM";
-    protected override string Suffix => _neighbors == 3 ? "" : $"-{_neighbors}";
+    protected override string Suffix => _neighbors == 3 && _flags == "" ? "" : $"-{_neighbors}{_flags}";
         
     // algo params
     private readonly int _neighbors;
+    private readonly string _flags; // passed through to iim.py, e.g. "a" for adaptive or "ap4" for adaptive over 4 processes
 
-    public IIMAlgorithm(int n = 3)
+    // instrumented recoveries of each thread, a tick is recovered and written by one thread
+    private readonly ConcurrentDictionary<int, List<ImputeRecovery>> _recoveries = new();
+
+    public IIMAlgorithm(int n = 3, string flags = "")
     {
         _neighbors = n;
-        UseParallel = Algorithm.ParallelFull;
+        _flags = flags;
+        // process-parallel IIM already occupies the cores by itself
+        UseParallel = flags.Contains('p') ? Algorithm.ParallelNone : Algorithm.ParallelFull;
     }
     
     // functions
     protected override void RecoverInternal(ref Matrix<double> input)
     {
-        (_, input) = PythonPipeImpute.PythonIIM(input, _neighbors);
+        (long runtime, input, var phases) = PythonPipeImpute.PythonIIM(input, _neighbors, _flags);
+
+        if (phases != null) // flag "i"
+        {
+            string phaseText = String.Join("; ", phases.Select(p => $"{p.Key} {p.Value.TimeUs:F0}us x{p.Value.Calls} peak {p.Value.PeakBytes >> 10}KiB"));
+            Console.WriteLine($"[{AlgCode}] {input.RowCount}x{input.ColumnCount} runtime {runtime}us: {phaseText}");
+            _recoveries.GetOrAdd(Environment.CurrentManagedThreadId, _ => new List<ImputeRecovery>())
+                .Add(new ImputeRecovery(input.RowCount, input.ColumnCount, runtime, phases));
+        }
     }
+
+    public override IReadOnlyList<ImputeRecovery>? TakeInstrumentation()
+        => _recoveries.TryRemove(Environment.CurrentManagedThreadId, out List<ImputeRecovery>? recoveries) ? recoveries : null;
 }
@@ -1,11 +1,13 @@
 ﻿using System;
 using System.Collections.Generic;
 using System.Collections.Immutable;
+using System.Globalization;
 using System.IO;
 using System.Linq;
 using CleanIMP.Algorithms.Imputation;
 using CleanIMP.Testing;
 using CleanIMP.Utilities;
+using CleanIMP.Utilities.Interop;
 
 namespace CleanIMP.Config;
 
@@ -33,6 +35,9 @@ public abstract class TaskConfig<TScenario>
     public readonly bool PerformEvaluation = false;
     public readonly bool PerformNormalization = true;
     public readonly bool ParallelizeDownstream = true;
+    public readonly bool PersistentWorkers = false; // downstream scripts run in pooled python workers instead of one process per job
+    public readonly int ResultCache = 0; // MiB of downstream results cached by input content, 0 disables the cache
+    public readonly double DownstreamTimeLimit = 0.0; // minutes of training per classification job, 0 for unbounded
 
     public readonly ReferenceBehavior Reference = ReferenceBehavior.Both;
     
@@ -102,6 +107,24 @@ public abstract class TaskConfig<TScenario>
             ParallelizeDownstream = Convert.ToBoolean(configFileParams.Consume("parallelizedownstream"));
         }
 
+        if (configFileParams.ContainsKey("persistentworkers"))
+        {
+            PersistentWorkers = Convert.ToBoolean(configFileParams.Consume("persistentworkers"));
+            PythonScriptWorker.Enabled = PersistentWorkers;
+        }
+
+        if (configFileParams.ContainsKey("resultcache"))
+        {
+            ResultCache = Convert.ToInt32(configFileParams.Consume("resultcache"));
+            PythonScriptWorker.ResultCacheMegabytes = ResultCache > 0 ? ResultCache : null;
+        }
+
+        if (configFileParams.ContainsKey("downstreamtimelimit"))
+        {
+            DownstreamTimeLimit = Convert.ToDouble(configFileParams.Consume("downstreamtimelimit"), CultureInfo.InvariantCulture);
+            PythonScriptWorker.TimeLimitMinutes = DownstreamTimeLimit > 0 ? DownstreamTimeLimit : null;
+        }
+
         if (configFileParams.ContainsKey("reference"))
         {
             switch (configFileParams.Consume("reference").ToLower())
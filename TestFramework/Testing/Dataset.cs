@@ -55,6 +55,14 @@ public interface IDataset<out TData, in TConfig, in TScenario, TDown>
     void RecoverData(TConfig config, Algorithm alg);
 
     (long, TDown) RunDownstream(TConfig config, string downAlgo, int slot);
+
+    // several downstream algorithms on the same data, tasks which can share the work between them override this
+    (string, long, TDown)[] RunDownstream(TConfig config, IReadOnlyList<string> downAlgos, int slot)
+        => downAlgos.Select(downAlgo =>
+        {
+            (long rt, TDown res) = RunDownstream(config, downAlgo, slot);
+            return (downAlgo, rt, res);
+        }).ToArray();
 }
 
 //
@@ -208,6 +216,10 @@ public struct UnivarDataset : IDataset<UnivarDataset, UniClassConfig, ScenarioUn
 
     public (long, string[]) RunDownstream(UniClassConfig config, string downAlgo, int slot)
         => UnivariateClassification.RunClassification(Headers, this, downAlgo, slot);
+
+    public (string, long, string[])[] RunDownstream(UniClassConfig config, IReadOnlyList<string> downAlgos, int slot)
+        => UnivariateClassification.RunClassifications(Headers, this, downAlgos, slot)
+            .Select(x => (x.Key, x.Value.Item1, x.Value.Item2)).ToArray();
 }
 
 public class UnivarSeries
@@ -620,6 +632,12 @@ public readonly struct MultivarDataset : IDataset<MultivarDataset, MvClassConfig
     {
         return MultivariateClassification.RunClassification(this, downAlgo, slot);
     }
+
+    public (string, long, string[])[] RunDownstream(MvClassConfig config, IReadOnlyList<string> downAlgos, int slot)
+    {
+        return MultivariateClassification.RunClassifications(this, downAlgos, slot)
+            .Select(x => (x.Key, x.Value.Item1, x.Value.Item2)).ToArray();
+    }
 }
 public class MultivarSeries
 {
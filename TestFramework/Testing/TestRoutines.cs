@@ -6,6 +6,7 @@ using CleanIMP.Algorithms.Analysis;
 using CleanIMP.Algorithms.Imputation;
 using CleanIMP.Config;
 using CleanIMP.Utilities;
+using CleanIMP.Utilities.Interop;
 
 namespace CleanIMP.Testing;
 
@@ -101,6 +102,10 @@ public static partial class TestRoutines<TTask, TConfig, TScenario, TData, TDown
                 string location = TestIO.ContaminatedLocation(config, data, scen, tick, alg);
 
                 TTask.WriteContamination(location, ds);
+
+                // per-phase instrumentation of the recoveries of this tick, next to the recovered data
+                IReadOnlyList<ImputeRecovery>? recoveries = alg.TakeInstrumentation();
+                if (recoveries != null) TestIOHelpers.DumpPhases(recoveries, $"{location}{data}.phases");
             });
         }
 
@@ -131,6 +136,7 @@ public static partial class TestRoutines<TTask, TConfig, TScenario, TData, TDown
 
         // 2.1 - produce reference (if doesn't exist) before doing anything else
         System.IO.Directory.CreateDirectory($"{config.DataWorkPath(data)}reference/");
+        PythonScriptWorker.ThreadBudget = Utils.DownstreamThreadBudget(1); // references run one at a time
 
         foreach (string calg in downAlgos)
         {
@@ -147,6 +153,11 @@ public static partial class TestRoutines<TTask, TConfig, TScenario, TData, TDown
                 
                 TTask.WriteDownstream(TestIOHelpers.ReferenceResultLocation(config.DataWorkPath(data), calg) + ".txt", res);
                 TestIOHelpers.DumpRuntime(rt, TestIOHelpers.ReferenceResultLocation(config.DataWorkPath(data), calg) + ".runtime");
+
+                // import/load/fit/predict split of the runtime, for the downstream algorithms that report it
+                DownstreamTimings? timings = DownstreamTimings.Take(0, calg);
+                if (timings != null) TestIOHelpers.DumpTimings(timings, TestIOHelpers.ReferenceResultLocation(config.DataWorkPath(data), calg) + ".timings");
+                if (timings?.BudgetHit == true) Console.WriteLine($"Reference {calg} hit its time budget of {timings.TimeLimitMinutes} minutes (enforced = {timings.BudgetEnforced}).");
             }
         }
 
@@ -161,19 +172,23 @@ public static partial class TestRoutines<TTask, TConfig, TScenario, TData, TDown
         {
             Console.WriteLine($"Algorithm: {alg.AlgCode}");
             int parallel = config.GetDownstreamParallel(ticks.Length);
+            PythonScriptWorker.ThreadBudget = Utils.DownstreamThreadBudget(parallel);
             
             ticks.AsParallel().WithDegreeOfParallelism(parallel).ForAll(tick =>
             {
-                foreach (string downAlgo in downAlgos)
-                {
-                    TData decontaminated = algorithmRecoveries[alg.AlgCode][tick];
-                    
-                    (_, TDown res) = decontaminated.RunDownstream(config, downAlgo, tick);
+                TData decontaminated = algorithmRecoveries[alg.AlgCode][tick];
 
+                // all downstream algorithms at once, the task can load the data a single time for them
+                foreach ((string downAlgo, _, TDown res) in decontaminated.RunDownstream(config, downAlgos, tick))
+                {
                     TestIO.CreateResultLocation(config, data, scen, tick, alg);
                     string resultLocation = TestIOHelpers.ResultLocation(config.DataWorkPath(data), scen.ToString()!, tick, alg);
 
                     TTask.WriteDownstream($"{resultLocation}{downAlgo}.txt", res);
+
+                    DownstreamTimings? timings = DownstreamTimings.Take(tick, downAlgo);
+                    if (timings != null) TestIOHelpers.DumpTimings(timings, $"{resultLocation}{downAlgo}.timings");
+                    if (timings?.BudgetHit == true) Console.WriteLine($"{downAlgo} on tick {tick} hit its time budget of {timings.TimeLimitMinutes} minutes (enforced = {timings.BudgetEnforced}).");
                 }
             });
             if (parallel > 1) Console.WriteLine($"Parallel execution over {parallel} threads.");
@@ -2,10 +2,12 @@
 using System.Collections.Generic;
 using System.IO;
 using System.Linq;
+using System.Text.Json;
 using CleanIMP.Algorithms.Analysis;
 using CleanIMP.Algorithms.Imputation;
 using CleanIMP.Config;
 using CleanIMP.Utilities;
+using CleanIMP.Utilities.Interop;
 
 namespace CleanIMP.Testing;
 
@@ -125,6 +127,12 @@ public static class TestIOHelpers
         IOTools.FileWriteAllText(path, runtime.ToString());
     }
 
+    public static void DumpTimings(DownstreamTimings timings, string path)
+        => IOTools.FileWriteAllText(path, timings.ToJson());
+
+    public static void DumpPhases(IReadOnlyList<ImputeRecovery> recoveries, string path)
+        => IOTools.FileWriteAllText(path, JsonSerializer.Serialize(recoveries));
+
     public static long LoadRuntimeFile(string filePath) => Int64.Parse(File.ReadAllText(filePath).Trim());
 
     public static string ReferenceResultLocation(string dataPath, string downstreamAlgo)
@@ -0,0 +1,63 @@
+﻿using System.Collections.Concurrent;
+using System.Linq;
+using System.Text.Json;
+using System.Text.Json.Serialization;
+
+namespace CleanIMP.Utilities.Interop;
+
+/// <summary>
+/// Phases of a downstream python job in microseconds, as reported in the trailer of the scripts (see timings.py).
+/// Interpreter startup is not part of any phase, it is only included in the total runtime measured around the launch.
+/// Results served by the python result cache (see resultcache.py) have <see cref="CacheHit"/> set and should be left out of timing studies.
+/// Jobs with a time budget (see timebudget.py) report it, whether the classifier could enforce it and whether it was hit; these are null without a budget.
+/// </summary>
+public sealed record DownstreamTimings(
+    [property: JsonPropertyName("import_us")] long ImportUs,
+    [property: JsonPropertyName("load_us")] long LoadUs,
+    [property: JsonPropertyName("fit_us")] long FitUs,
+    [property: JsonPropertyName("predict_us")] long PredictUs,
+    [property: JsonPropertyName("write_us")] long WriteUs,
+    [property: JsonPropertyName("cache_hit")] bool CacheHit = false,
+    [property: JsonPropertyName("time_limit_minutes")] double? TimeLimitMinutes = null,
+    [property: JsonPropertyName("budget_enforced")] bool? BudgetEnforced = null,
+    [property: JsonPropertyName("budget_hit")] bool? BudgetHit = null)
+{
+    private const string TrailerPrefix = "#timings ";
+
+    // last timings of each (slot, downstream algorithm), slots never run two jobs at the same time
+    private static readonly ConcurrentDictionary<(int, string), DownstreamTimings> Recorded = new();
+
+    /// <summary>
+    /// Separates the timings trailer from the rest of the output of a script
+    /// </summary>
+    /// <returns>The output without the trailer, and the timings if the script printed them</returns>
+    public static (string[], DownstreamTimings?) SplitTrailer(string[] output)
+    {
+        string? trailer = output.LastOrDefault(line => line.StartsWith(TrailerPrefix));
+        if (trailer == null) return (output, null);
+
+        return (output.Where(line => !line.StartsWith(TrailerPrefix)).ToArray(), Parse(trailer.Substring(TrailerPrefix.Length)));
+    }
+
+    public static DownstreamTimings? Parse(string json) => JsonSerializer.Deserialize<DownstreamTimings>(json);
+
+    public static void Record(int slot, string downAlgo, DownstreamTimings? timings)
+    {
+        if (timings == null)
+        {
+            Recorded.TryRemove((slot, downAlgo), out _);
+        }
+        else
+        {
+            Recorded[(slot, downAlgo)] = timings;
+        }
+    }
+
+    /// <summary>
+    /// Returns and forgets the timings of the last job of the downstream algorithm in the slot
+    /// </summary>
+    public static DownstreamTimings? Take(int slot, string downAlgo)
+        => Recorded.TryRemove((slot, downAlgo), out DownstreamTimings? timings) ? timings : null;
+
+    public string ToJson() => JsonSerializer.Serialize(this);
+}
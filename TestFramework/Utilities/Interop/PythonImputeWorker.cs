@@ -0,0 +1,148 @@
+﻿using System;
+using System.Collections.Concurrent;
+using System.Collections.Generic;
+using System.Diagnostics;
+using System.IO;
+using System.Text;
+using System.Text.Json;
+using System.Text.Json.Serialization;
+using MathNet.Numerics.LinearAlgebra;
+
+namespace CleanIMP.Utilities.Interop;
+
+/// <summary>
+/// Instrumentation of one phase of a python imputation, see <c>PhaseProfiler</c> in iim.py
+/// </summary>
+/// <param name="TimeUs">Total wall time of the phase in microseconds</param>
+/// <param name="Calls">Number of times the phase was entered</param>
+/// <param name="PeakBytes">Peak memory allocated by the phase in bytes</param>
+public sealed record ImputePhase(
+    [property: JsonPropertyName("time_us")] double TimeUs,
+    [property: JsonPropertyName("calls")] long Calls,
+    [property: JsonPropertyName("peak_bytes")] long PeakBytes);
+
+/// <summary>
+/// Instrumentation of one instrumented recovery: the size of the matrix, the runtime of the imputation and its phases
+/// </summary>
+public sealed record ImputeRecovery(
+    [property: JsonPropertyName("rows")] int Rows,
+    [property: JsonPropertyName("columns")] int Columns,
+    [property: JsonPropertyName("runtime_us")] long RuntimeUs,
+    [property: JsonPropertyName("phases")] IReadOnlyDictionary<string, ImputePhase> Phases);
+
+/// <summary>
+/// A long-lived python imputation process (<c>iim.py --server</c>) that imputes many matrices over one stdin/stdout pair.
+/// Idle workers are pooled and reused across ticks and datasets, so the interpreter start and the imports are only paid once per worker.
+/// </summary>
+public sealed class PythonImputeWorker : IDisposable
+{
+    private static readonly ConcurrentBag<PythonImputeWorker> IdleWorkers = new();
+    private static readonly int MaxIdleWorkers = Environment.ProcessorCount;
+
+    private readonly Process _proc;
+    private readonly BinaryWriter _stdin;
+    private readonly BinaryReader _stdout;
+
+    static PythonImputeWorker()
+    {
+        AppDomain.CurrentDomain.ProcessExit += (_, _) => Shutdown();
+    }
+
+    private PythonImputeWorker()
+    {
+        _proc = PythonPipeImpute.StartPythonImpute(Utils.PythonExec, "iim.py --server");
+        _stdin = new BinaryWriter(_proc.StandardInput.BaseStream);
+        _stdout = new BinaryReader(_proc.StandardOutput.BaseStream);
+    }
+
+    /// <summary>
+    /// Imputes a matrix in an idle worker of the pool, or in a new one if all of them are busy
+    /// </summary>
+    /// <param name="algCode">Algorithm and its parameters, e.g. "iim 3a"</param>
+    /// <param name="matrix">Input matrix with missing values as NaN</param>
+    /// <returns>Runtime of the imputation alone (in microseconds), the imputed matrix and the instrumentation of its phases if the algorithm code asks for it</returns>
+    /// <exception cref="InvalidOperationException">The algorithm failed on this matrix, its error is printed by the worker</exception>
+    public static (double, Matrix<double>, IReadOnlyDictionary<string, ImputePhase>?) Run(string algCode, Matrix<double> matrix)
+    {
+        PythonImputeWorker worker = IdleWorkers.TryTake(out PythonImputeWorker? idle) ? idle : new PythonImputeWorker();
+
+        (double runtime, Matrix<double> result, IReadOnlyDictionary<string, ImputePhase>? phases) response;
+        try
+        {
+            response = worker.Impute(algCode, matrix);
+        }
+        catch
+        {
+            // the exchange broke off, the worker is in an unknown state
+            worker.Dispose();
+            throw;
+        }
+
+        if (IdleWorkers.Count < MaxIdleWorkers)
+        {
+            IdleWorkers.Add(worker);
+        }
+        else
+        {
+            worker.Dispose();
+        }
+
+        if (Double.IsNaN(response.runtime))
+        {
+            throw new InvalidOperationException($"Python imputation \"{algCode}\" failed, see the error output of the worker");
+        }
+        return response;
+    }
+
+    /// <summary>
+    /// Stops all idle workers, workers that are still busy are stopped when they are returned
+    /// </summary>
+    public static void Shutdown()
+    {
+        while (IdleWorkers.TryTake(out PythonImputeWorker? worker))
+        {
+            worker.Dispose();
+        }
+    }
+
+    private (double, Matrix<double>, IReadOnlyDictionary<string, ImputePhase>?) Impute(string algCode, Matrix<double> matrix)
+    {
+        byte[] code = Encoding.UTF8.GetBytes(algCode);
+        _stdin.Write(code.Length);
+        _stdin.Write(code);
+        PythonPipeImpute.WriteMatrixFrame(_stdin, matrix);
+
+        double runtime = _stdout.ReadDouble();
+        Matrix<double> result = PythonPipeImpute.ReadMatrixFrame(_stdout);
+        string instrumentation = Encoding.UTF8.GetString(_stdout.ReadBytes(_stdout.ReadInt32()));
+        return (runtime, result, ParseInstrumentation(instrumentation));
+    }
+
+    /// <summary>
+    /// Parses the instrumentation line of a response, <c>{"runtime_us": ..., "phases": {phase: {...}}}</c>
+    /// </summary>
+    /// <returns>Instrumentation of every phase, null if the line is empty</returns>
+    private static IReadOnlyDictionary<string, ImputePhase>? ParseInstrumentation(string line)
+    {
+        if (line.Length == 0) return null;
+
+        using JsonDocument doc = JsonDocument.Parse(line);
+        return doc.RootElement.GetProperty("phases").Deserialize<Dictionary<string, ImputePhase>>();
+    }
+
+    public void Dispose()
+    {
+        try
+        {
+            _stdin.Dispose(); // will send EOF so the server loop ends
+        }
+        catch (IOException)
+        {
+            // the process is already gone
+        }
+        _proc.WaitForExit();
+        PythonPipeImpute.WarnOnExitCode(_proc, Utils.PythonExec);
+        _stdout.Dispose();
+        _proc.Dispose();
+    }
+}
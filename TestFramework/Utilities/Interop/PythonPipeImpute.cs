@@ -2,6 +2,7 @@
 using System.Collections.Generic;
 using System.Diagnostics;
 using System.IO;
+using System.Text;
 using CleanIMP.Utilities.Mathematical;
 using MathNet.Numerics.LinearAlgebra;
 
@@ -15,6 +16,11 @@ public static class PythonPipeImpute
 {
     private const string PyImputeLocation = "../external_code/impute/";
     
+    /// <summary>
+    /// Data type of the values in a binary matrix frame, as a NumPy dtype string padded to 8 bytes
+    /// </summary>
+    private const string FrameDtype = "<f8";
+    
     /// <summary>
     /// Main function to run python imputation algorithms through pipes
     /// </summary>
@@ -28,24 +34,7 @@ public static class PythonPipeImpute
     /// <returns>Imputed matrix in the same string format as the input</returns>
     private static IEnumerable<string> RunPythonImpute(string command, string cliArgs, IEnumerable<string> inputMatrix, string workingDir = PyImputeLocation)
     {
-        Process proc = new()
-        {
-            StartInfo =
-            {
-                WorkingDirectory = workingDir,
-                FileName = command,
-                CreateNoWindow = true,
-                WindowStyle = ProcessWindowStyle.Hidden,
-                UseShellExecute = false,
-                RedirectStandardInput = true, // to send in the matrix
-                RedirectStandardOutput = true, // to get the imputed output
-                RedirectStandardError = false, // errors/warnings will be printed to the current terminal session
-                Arguments = cliArgs
-            }
-        };
-
-        // launch
-        proc.Start();
+        Process proc = StartPythonImpute(command, cliArgs, workingDir);
     
         // write matrix to stdin
         StreamWriter sw = proc.StandardInput;
@@ -65,7 +54,74 @@ public static class PythonPipeImpute
             yield return line;
         }
         proc.WaitForExit();
+        WarnOnExitCode(proc, command);
+    }
+
+    /// <summary>
+    /// Writes a matrix as a binary frame
+    /// </summary>
+    /// <remarks>
+    /// A frame is a header of the rows (int64), the columns (int64) and the dtype (<see cref="FrameDtype"/>, 8 ASCII bytes),
+    /// followed by the values in row-major order as little-endian float64. See <c>read_matrix_frame</c> in iim.py.
+    /// </remarks>
+    internal static void WriteMatrixFrame(BinaryWriter bw, Matrix<double> matrix)
+    {
+        bw.Write((long)matrix.RowCount);
+        bw.Write((long)matrix.ColumnCount);
+        bw.Write(Encoding.ASCII.GetBytes(FrameDtype.PadRight(8)));
+        foreach (double value in matrix.ToRowMajorArray())
+        {
+            bw.Write(value);
+        }
+        bw.Flush();
+    }
 
+    /// <summary>
+    /// Reads a matrix from a binary frame, see <see cref="WriteMatrixFrame"/>
+    /// </summary>
+    internal static Matrix<double> ReadMatrixFrame(BinaryReader br)
+    {
+        int rows = (int)br.ReadInt64();
+        int columns = (int)br.ReadInt64();
+        string dtype = Encoding.ASCII.GetString(br.ReadBytes(8)).TrimEnd(' ', '\0');
+        if (dtype != FrameDtype)
+        {
+            throw new InvalidDataException($"Unsupported dtype {dtype} in matrix frame, expected {FrameDtype}");
+        }
+
+        double[] values = new double[rows * columns];
+        for (int i = 0; i < values.Length; i++)
+        {
+            values[i] = br.ReadDouble();
+        }
+        return Matrix<double>.Build.DenseOfRowMajor(rows, columns, values);
+    }
+
+    internal static Process StartPythonImpute(string command, string cliArgs, string workingDir = PyImputeLocation)
+    {
+        Process proc = new()
+        {
+            StartInfo =
+            {
+                WorkingDirectory = workingDir,
+                FileName = command,
+                CreateNoWindow = true,
+                WindowStyle = ProcessWindowStyle.Hidden,
+                UseShellExecute = false,
+                RedirectStandardInput = true, // to send in the matrix
+                RedirectStandardOutput = true, // to get the imputed output
+                RedirectStandardError = false, // errors/warnings will be printed to the current terminal session
+                Arguments = cliArgs
+            }
+        };
+
+        // launch
+        proc.Start();
+        return proc;
+    }
+
+    internal static void WarnOnExitCode(Process proc, string command)
+    {
         if (proc.ExitCode != 0)
         {
             string errText =
@@ -76,9 +132,23 @@ public static class PythonPipeImpute
         }
     }
 
-    public static (long, Matrix<double>) PythonIIM(Matrix<double> matrix, int neighbors)
+    /// <summary>
+    /// Runs IIM in a pooled python worker, see <see cref="PythonImputeWorker"/>
+    /// </summary>
+    /// <returns>Runtime, imputed matrix and the instrumentation of the phases if the flags contain "i"</returns>
+    public static (long, Matrix<double>, IReadOnlyDictionary<string, ImputePhase>?) PythonIIM(Matrix<double> matrix, int neighbors, string flags = "")
+    {
+        (double runtime, Matrix<double> res, IReadOnlyDictionary<string, ImputePhase>? phases) = PythonImputeWorker.Run($"iim {neighbors}{flags}", matrix);
+
+        return ((long)runtime, res, phases);
+    }
+
+    /// <summary>
+    /// Text version of <see cref="PythonIIM"/> in a new process, kept for compatibility with the matrix exchange before binary frames
+    /// </summary>
+    public static (long, Matrix<double>) PythonIIMText(Matrix<double> matrix, int neighbors, string flags = "")
     {
-        string cliParams = $"-c \"from iim import impute_piped_data; impute_piped_data({$"iim {neighbors}".EnquoteEsc()});\"";
+        string cliParams = $"-c \"from iim import impute_piped_data; impute_piped_data({$"iim {neighbors}{flags}".EnquoteEsc()});\"";
 
         (string runtime, IEnumerable<string> res) = RunPythonImpute(Utils.PythonExec, cliParams, matrix.ExportMx()).HeadTail();
 
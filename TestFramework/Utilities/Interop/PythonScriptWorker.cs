@@ -0,0 +1,176 @@
+﻿using System;
+using System.Collections.Concurrent;
+using System.Diagnostics;
+using System.Globalization;
+using System.IO;
+using System.Linq;
+using System.Text.Json;
+using System.Text.Json.Serialization;
+
+namespace CleanIMP.Utilities.Interop;
+
+/// <summary>
+/// Response of a downstream worker to one job, see worker.py
+/// </summary>
+/// <param name="ExitCode">Exit code of the script</param>
+/// <param name="Stdout">Everything the script printed</param>
+/// <param name="RuntimeUs">Wall time of the job inside the worker in microseconds</param>
+public sealed record ScriptResponse(
+    [property: JsonPropertyName("exit_code")] int ExitCode,
+    [property: JsonPropertyName("stdout")] string Stdout,
+    [property: JsonPropertyName("runtime_us")] double RuntimeUs);
+
+/// <summary>
+/// A long-lived python process (<c>worker.py</c>) that runs the downstream scripts (classify.py, prediction*.py) as jobs.
+/// The heavy libraries are imported once per worker instead of once per job. Idle workers are pooled per working directory.
+/// Jobs are only routed to the workers if <see cref="Enabled"/> is set (config key <c>persistentworkers</c>), otherwise every job starts a new interpreter.
+/// </summary>
+public sealed class PythonScriptWorker : IDisposable
+{
+    public static bool Enabled { get; set; } = false;
+
+    /// <summary>
+    /// Threads of one downstream job, passed to the scripts as <c>--threads</c>; null lets every library pick its own
+    /// </summary>
+    public static int? ThreadBudget { get; set; } = null;
+
+    /// <summary>
+    /// Size bound of the downstream result cache in MiB, passed to the scripts as <c>--cache</c>; null disables the cache
+    /// </summary>
+    public static int? ResultCacheMegabytes { get; set; } = null;
+
+    /// <summary>
+    /// Training time budget of a classification job in minutes, passed to classify.py as <c>--time-limit</c>; null leaves the training unbounded
+    /// </summary>
+    public static double? TimeLimitMinutes { get; set; } = null;
+
+    private static readonly ConcurrentDictionary<string, ConcurrentBag<PythonScriptWorker>> IdleWorkers = new();
+    private static readonly int MaxIdleWorkers = Environment.ProcessorCount;
+
+    private readonly Process _proc;
+    private readonly string _workingDir;
+
+    static PythonScriptWorker()
+    {
+        AppDomain.CurrentDomain.ProcessExit += (_, _) => Shutdown();
+    }
+
+    private PythonScriptWorker(string workingDir)
+    {
+        _workingDir = workingDir;
+        _proc = PythonPipeImpute.StartPythonImpute(Utils.PythonExec, "worker.py", workingDir);
+    }
+
+    /// <summary>
+    /// Runs a downstream script, in a worker of the pool if they are enabled, or in a new process otherwise
+    /// </summary>
+    /// <param name="script">Script name, e.g. "classify.py"</param>
+    /// <param name="cliArgs">Arguments of the script separated by spaces</param>
+    /// <param name="workingDir">Directory of the script</param>
+    /// <returns>Lines printed by the script</returns>
+    public static string[] RunScript(string script, string cliArgs, string workingDir)
+    {
+        if (ThreadBudget.HasValue)
+        {
+            cliArgs += $" --threads {ThreadBudget.Value}";
+        }
+
+        if (ResultCacheMegabytes.HasValue)
+        {
+            cliArgs += $" --cache {ResultCacheMegabytes.Value}";
+        }
+
+        if (TimeLimitMinutes.HasValue && script == "classify.py") // the forecasters have no contract mechanism
+        {
+            cliArgs += $" --time-limit {TimeLimitMinutes.Value.ToString(CultureInfo.InvariantCulture)}";
+        }
+
+        if (!Enabled)
+        {
+            return Utils.RunOutputProcess(Utils.PythonExec, $"{script} {cliArgs}", workingDir).ToArray();
+        }
+
+        ScriptResponse response = Run(script, cliArgs.Split(' ', StringSplitOptions.RemoveEmptyEntries), workingDir);
+        
+        if (response.ExitCode != 0)
+        {
+            Console.WriteLine($"[WARNING] Worker job {script} returned code {response.ExitCode}.{Environment.NewLine}CLI args: {cliArgs}");
+        }
+        return response.Stdout.Split('\n', StringSplitOptions.RemoveEmptyEntries).Select(line => line.TrimEnd('\r')).ToArray();
+    }
+
+    /// <summary>
+    /// Runs a job in an idle worker of the pool, or in a new one if all of them are busy
+    /// </summary>
+    /// <exception cref="IOException">The worker stopped before answering</exception>
+    public static ScriptResponse Run(string script, string[] args, string workingDir)
+    {
+        ConcurrentBag<PythonScriptWorker> idle = IdleWorkers.GetOrAdd(workingDir, _ => new ConcurrentBag<PythonScriptWorker>());
+        PythonScriptWorker worker = idle.TryTake(out PythonScriptWorker? available) ? available : new PythonScriptWorker(workingDir);
+
+        ScriptResponse response;
+        try
+        {
+            response = worker.Execute(script, args);
+        }
+        catch
+        {
+            // the exchange broke off, the worker is in an unknown state
+            worker.Dispose();
+            throw;
+        }
+
+        if (idle.Count < MaxIdleWorkers)
+        {
+            idle.Add(worker);
+        }
+        else
+        {
+            worker.Dispose();
+        }
+
+        return response;
+    }
+
+    /// <summary>
+    /// Stops all idle workers, workers that are still busy are stopped when they are returned
+    /// </summary>
+    public static void Shutdown()
+    {
+        foreach (ConcurrentBag<PythonScriptWorker> idle in IdleWorkers.Values)
+        {
+            while (idle.TryTake(out PythonScriptWorker? worker))
+            {
+                worker.Dispose();
+            }
+        }
+    }
+
+    private ScriptResponse Execute(string script, string[] args)
+    {
+        _proc.StandardInput.WriteLine(JsonSerializer.Serialize(new { script, args }));
+        _proc.StandardInput.Flush();
+
+        string? line = _proc.StandardOutput.ReadLine();
+        if (line == null)
+        {
+            throw new IOException($"Downstream worker in {_workingDir} stopped while running {script}");
+        }
+        return JsonSerializer.Deserialize<ScriptResponse>(line)!;
+    }
+
+    public void Dispose()
+    {
+        try
+        {
+            _proc.StandardInput.Close(); // will send EOF so the worker loop ends
+        }
+        catch (IOException)
+        {
+            // the process is already gone
+        }
+        _proc.WaitForExit();
+        PythonPipeImpute.WarnOnExitCode(_proc, Utils.PythonExec);
+        _proc.Dispose();
+    }
+}
@@ -138,6 +138,10 @@ public static class Utils
         // n = ceil(ticks / t) = minimal number of parallel threads needed to complete the task in a given number of runs
         return (int)Math.Round(instances / Math.Ceiling(instances / cpus));
     }
+
+    // threads of one downstream job while `parallel` jobs run at the same time, so that together they fill the machine
+    public static int DownstreamThreadBudget(int parallel)
+        => Math.Max(1, ParallelExecutionNo() / Math.Max(1, parallel));
     
     public static int ParallelExecutionNo(int instances, int factor)
     {
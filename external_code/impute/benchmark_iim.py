@@ -0,0 +1,231 @@
+"""Offline benchmark of the IIM implementation in iim.py, independent of the test framework.
+
+Synthetic matrices of controlled size, missing rate and missing pattern are recovered by iim_recovery over a grid of
+parameters. Every configuration is timed, checked against the frozen reference implementation (iim_reference.py)
+on all its missing cells or on a sample of its incomplete tuples (--reference-max-cells), and written as one record of
+a JSON file, so that runs of different commits can be compared.
+The approximate neighbor search is checked for its recall against the exact search instead (--min-recall), on the
+patterns it is expected to handle (--recall-patterns); its recall on the other patterns is only reported, see
+iim.ProjectionNeighborIndex for the patterns it handles badly.
+The script exits with 1 if any check fails.
+
+Example:
+    python benchmark_iim.py --rows 1000 5000 --columns 10 --patterns single multi block --output iim_bench.json
+"""
+
+import sys
+import time
+import json
+import platform
+import argparse
+import itertools
+import subprocess
+import numpy as np
+import sklearn
+
+import iim
+from iim_reference import reference_recovery
+
+PATTERNS = ("single", "multi", "block")
+
+
+def synthetic_matrix(rows: int, columns: int, seed: int = 0):
+    """A complete matrix of correlated sensor-like series: every column is a noisy sinusoid with its own frequency
+    and phase, on top of a random walk shared by all columns. Columns are z-normalized like the framework's input.
+    """
+    rng = np.random.default_rng(seed)
+    time_axis = np.arange(rows)[:, None]
+    periods = rng.uniform(20, 400, columns)
+    phases = rng.uniform(0, 2 * np.pi, columns)
+    trend = np.cumsum(rng.normal(size=(rows, 1)), axis=0) / np.sqrt(rows)
+    matrix = np.sin(2 * np.pi * time_axis / periods + phases) + trend + 0.1 * rng.normal(size=(rows, columns))
+    return (matrix - matrix.mean(axis=0)) / matrix.std(axis=0)
+
+
+def contaminate(matrix: np.ndarray, missing_rate: float, pattern: str, seed: int = 0):
+    """Removes values of a copy of the matrix.
+
+    Parameters
+    ----------
+    matrix : np.ndarray
+        The complete matrix.
+    missing_rate : float
+        The fraction of missing values (single, multi) or the length of a block as a fraction of the rows (block).
+    pattern : str
+        - single: missing_rate of the values, never more than one per row
+        - multi: missing_rate of the values, uniformly at random, so rows can miss several attributes
+        - block: like the framework's mc scenarios, a block of missing_rate of the rows in each of the first half
+          of the columns, consecutive columns having consecutive blocks
+    seed : int, optional
+        The seed of the random patterns, by default 0.
+
+    Returns
+    -------
+    np.ndarray
+        The contaminated copy, with missing values as NaN.
+    """
+    rng = np.random.default_rng(seed)
+    rows, columns = matrix.shape
+    mask = np.zeros(matrix.shape, dtype=bool)
+
+    if pattern == "single":
+        cells = min(int(missing_rate * rows * columns), rows - 1)
+        selected_rows = rng.choice(rows, cells, replace=False)
+        mask[selected_rows, rng.integers(0, columns, cells)] = True
+    elif pattern == "multi":
+        mask = rng.random(matrix.shape) < missing_rate
+    elif pattern == "block":
+        block_length = max(int(rows * missing_rate), 1)
+        loop = max(int(1 / missing_rate), 1)
+        for column in range(max(columns // 2, 1)):
+            start = (column % loop) * block_length
+            mask[start:start + block_length, column] = True
+    else:
+        raise ValueError("Unknown missing pattern: " + pattern)
+
+    contaminated = matrix.copy()
+    contaminated[mask] = np.nan
+    return contaminated
+
+
+def time_recovery(matrix_nan: np.ndarray, repeats: int, **parameters):
+    """Runs iim_recovery on fresh copies of the matrix, returns the wall times in seconds and the last result."""
+    times, result = [], None
+    for _ in range(repeats):
+        matrix = matrix_nan.copy()
+        start_time = time.perf_counter()
+        result = iim.iim_recovery(matrix, **parameters)
+        times.append(time.perf_counter() - start_time)
+    return times, result
+
+
+def reference_sample(matrix_nan: np.ndarray, max_cells: int, seed: int = 0):
+    """Rows of the matrix the reference check runs on: all complete tuples and random incomplete tuples holding at most
+    max_cells missing cells (at least one tuple). The imputation of an incomplete tuple only depends on the complete
+    tuples, so the sample gives the same values as the full matrix on its incomplete tuples.
+    """
+    missing_per_row = np.isnan(matrix_nan).sum(axis=1)
+    incomplete = np.random.default_rng(seed).permutation(np.flatnonzero(missing_per_row))
+    taken = max(int(np.searchsorted(np.cumsum(missing_per_row[incomplete]), max_cells, side="right")), 1)
+    keep = missing_per_row == 0
+    keep[incomplete[:taken]] = True
+    return keep
+
+
+def learning_neighbor_recall(matrix_nan: np.ndarray, backend: str, neighbors: int):
+    """Recall of the learning neighbors found with the backend against the exact brute-force search."""
+    tuples_with_nan = np.isnan(matrix_nan).any(axis=1)
+    complete_tuples, incomplete_tuples = matrix_nan[~tuples_with_nan], matrix_nan[tuples_with_nan]
+    neighbors = min(neighbors, len(complete_tuples))
+    exact = iim.make_neighbor_index(complete_tuples, "brute").query_incomplete(incomplete_tuples, neighbors)
+    found = iim.make_neighbor_index(complete_tuples, backend).query_incomplete(incomplete_tuples, neighbors)
+    return iim.neighbor_recall(found, exact)
+
+
+def environment():
+    """Versions and machine of the run, for comparing results across commits."""
+    try:
+        commit = subprocess.run(["git", "rev-parse", "HEAD"], capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    return {
+        "commit": commit,
+        "python": platform.python_version(),
+        "numpy": np.__version__,
+        "sklearn": sklearn.__version__,
+        "machine": platform.machine(),
+        "processor": platform.processor(),
+        "cpu_count": iim.os.cpu_count(),
+    }
+
+
+def run_benchmark(arguments):
+    results = []
+    grid = itertools.product(arguments.rows, arguments.columns, arguments.missing_rates, arguments.patterns,
+                             arguments.modes, arguments.neighbors, arguments.backends, arguments.precisions)
+    for rows, columns, missing_rate, pattern, mode, neighbors, backend, precision in grid:
+        matrix = synthetic_matrix(rows, columns, arguments.seed)
+        matrix_nan = contaminate(matrix, missing_rate, pattern, arguments.seed)
+        missing = np.isnan(matrix_nan)
+        parameters = dict(adaptive_flag=mode == "adaptive", learning_neighbors=neighbors, neighbor_index=backend,
+                          dtype=np.dtype(precision))
+        tolerance = arguments.tolerance if precision == "float64" else arguments.float32_tolerance
+
+        times, result = time_recovery(matrix_nan, arguments.repeats, **parameters)
+        record = {
+            "rows": rows, "columns": columns, "missing_rate": missing_rate, "pattern": pattern, "mode": mode,
+            "neighbors": neighbors, "backend": backend, "precision": precision,
+            "missing_cells": int(missing.sum()), "incomplete_rows": int(missing.any(axis=1).sum()),
+            "times_s": times, "best_s": min(times), "median_s": float(np.median(times)),
+            "rmse": float(np.sqrt(np.mean((result[missing] - matrix[missing]) ** 2))),
+            "reference": None, "recall": None, "float64": None,
+        }
+
+        # accuracy of the reduced precision against the same run in float64, on matrices of any size
+        if precision != "float64":
+            _, expected = time_recovery(matrix_nan, 1, **dict(parameters, dtype=np.float64))
+            max_difference = float(np.max(np.abs(result[missing] - expected[missing]), initial=0.0))
+            record["float64"] = {"max_abs_difference": max_difference, "within_tolerance": max_difference <= tolerance}
+
+        # the approximate search is not expected to match the reference, it reports its recall instead
+        exact = backend != "approximate"
+        if not exact:
+            recall = learning_neighbor_recall(matrix_nan, backend, neighbors)
+            gated = pattern in arguments.recall_patterns
+            record["recall"] = {"value": recall, "within_tolerance": recall >= arguments.min_recall if gated else None}
+
+        if missing.any():
+            sample = reference_sample(matrix_nan, arguments.reference_max_cells, arguments.seed)
+            expected = reference_recovery(matrix_nan[sample], mode == "adaptive", neighbors)
+            checked = missing[sample]
+            max_difference = float(np.max(np.abs(result[sample][checked] - expected[checked]), initial=0.0))
+            record["reference"] = {"max_abs_difference": max_difference, "cells": int(checked.sum()),
+                                   "within_tolerance": max_difference <= tolerance if exact else None}
+
+        results.append(record)
+        print("{rows}x{columns} {pattern} {missing_rate} {mode} l={neighbors} {backend}: "
+              "{precision}: best {best_s:.4f}s, reference {reference}, recall {recall}, float64 {float64}".format(**record), file=sys.stderr)
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmarks iim_recovery on synthetic matrices.")
+    parser.add_argument("--rows", type=int, nargs="+", default=[500, 2000])
+    parser.add_argument("--columns", type=int, nargs="+", default=[10])
+    parser.add_argument("--missing-rates", type=float, nargs="+", default=[0.05])
+    parser.add_argument("--patterns", nargs="+", choices=PATTERNS, default=list(PATTERNS))
+    parser.add_argument("--modes", nargs="+", choices=("plain", "adaptive"), default=["plain", "adaptive"])
+    parser.add_argument("--neighbors", type=int, nargs="+", default=[3, 10])
+    parser.add_argument("--backends", nargs="+", choices=("auto",) + tuple(iim.NEIGHBOR_INDEX_BACKENDS),
+                        default=["brute"])
+    parser.add_argument("--precisions", nargs="+", choices=("float64", "float32"), default=["float64"])
+    parser.add_argument("--repeats", type=int, default=3)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--reference-max-cells", type=int, default=20,
+                        help="compare against the (slow) reference on a sample of incomplete tuples with at most this "
+                             "many missing cells")
+    parser.add_argument("--tolerance", type=float, default=1e-8,
+                        help="maximum absolute difference to the reference")
+    parser.add_argument("--float32-tolerance", type=float, default=1e-3,
+                        help="maximum absolute difference of a float32 run to the reference and to the float64 run")
+    parser.add_argument("--min-recall", type=float, default=0.9,
+                        help="minimum recall of the learning neighbors of the approximate search against the exact search")
+    parser.add_argument("--recall-patterns", nargs="+", choices=PATTERNS, default=["single"],
+                        help="patterns the minimum recall applies to, the recall of the others is only reported")
+    parser.add_argument("--output", default="iim_benchmark.json")
+    arguments = parser.parse_args()
+
+    results = run_benchmark(arguments)
+    with open(arguments.output, "w") as output:
+        json.dump({"environment": environment(), "arguments": vars(arguments), "results": results}, output, indent=2)
+
+    failed = [record for record in results
+              if any(record[check] and record[check]["within_tolerance"] is False for check in ("reference", "float64", "recall"))]
+    if failed:
+        print("{} configurations differ from the reference implementation or miss the minimum recall".format(len(failed)),
+              file=sys.stderr)
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,15 +1,120 @@
+import os
 import sys
 import time
 import re
+import struct
+import argparse
+import traceback
+import json
+import functools
+import tracemalloc
+import hashlib
+from abc import ABC, abstractmethod
+from contextlib import contextmanager
 import numpy as np
-from typing import List
-from multiprocessing import Pool
-from sklearn.neighbors import NearestNeighbors
-from sklearn.linear_model import Ridge
+from collections import OrderedDict
+from typing import List, NamedTuple
+from multiprocessing import Pool, shared_memory
+from sklearn.neighbors import BallTree, KDTree
 
 global rmse;
 
-def iim_recovery(matrix_nan: np.ndarray, adaptive_flag: bool = False, learning_neighbors: int = 10):
+# upper bound on the number of pairwise candidate differences held in memory at once
+CANDIDATE_BLOCK_ELEMENTS = 1 << 22
+# upper bound on the number of query-to-complete-tuple distances held in memory at once
+NEIGHBOR_BLOCK_ELEMENTS = 1 << 22
+# number of attribute subsets (missing patterns) a neighbor index keeps its search structure for
+SUBSPACE_CACHE_SIZE = 16
+# neighbor index selection of make_neighbor_index
+TREE_KD_MAX_ATTRIBUTES = 15
+TREE_MIN_TUPLES = 50000
+# block size of chunked recoveries if the alg code does not give one
+DEFAULT_CHUNK_ROWS = 4096
+# size limit of a neighborhood cache if none is given, and the estimated bookkeeping bytes of one cached search
+DEFAULT_CACHE_BYTES = 256 << 20
+CACHE_ENTRY_OVERHEAD = 200
+# complete rows of a StreamingIIM searched by brute force before they are indexed
+STREAM_BUFFER_ROWS = 1024
+# binary matrix frames of the pipe: rows, columns and the NumPy dtype string (space padded), then the raw values
+FRAME_HEADER = struct.Struct("<qq8s")
+FRAME_DTYPE = "<f8"
+
+
+class PhaseProfiler:
+    """Opt-in instrumentation of the IIM phases: wall time, number of calls and peak allocated memory of each phase.
+
+    Disabled by default, then a phase costs one attribute lookup. While enabled, memory is traced with tracemalloc
+    and the peak of a phase is the highest allocation above the memory in use when the phase started, nested phases
+    included. Phases run in the worker processes of adaptive_multi are only seen through the wall time of the parent.
+    """
+
+    def __init__(self):
+        self.enabled = False
+        self.phases = {}
+        self._stack = []
+
+    def start(self):
+        """Enables the instrumentation and clears the previous records."""
+        self.phases = {}
+        self._stack = []
+        if not tracemalloc.is_tracing():
+            tracemalloc.start()
+        self.enabled = True
+
+    def stop(self):
+        """Disables the instrumentation and returns the records as {phase: {"time_us", "calls", "peak_bytes"}}."""
+        self.enabled = False
+        if tracemalloc.is_tracing():
+            tracemalloc.stop()
+        return self.phases
+
+    @contextmanager
+    def phase(self, name: str):
+        if not self.enabled:
+            yield
+            return
+
+        current, peak = tracemalloc.get_traced_memory()
+        if self._stack:
+            self._stack[-1]["peak"] = max(self._stack[-1]["peak"], peak)
+        tracemalloc.reset_peak()
+        frame = {"start_memory": current, "peak": current}
+        self._stack.append(frame)
+        start_time = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - start_time
+            frame["peak"] = max(frame["peak"], tracemalloc.get_traced_memory()[1])
+            self._stack.pop()
+            if self._stack:
+                self._stack[-1]["peak"] = max(self._stack[-1]["peak"], frame["peak"])
+            tracemalloc.reset_peak()
+
+            record = self.phases.setdefault(name, {"time_us": 0.0, "calls": 0, "peak_bytes": 0})
+            record["time_us"] += elapsed * 1000 * 1000
+            record["calls"] += 1
+            record["peak_bytes"] = max(record["peak_bytes"], frame["peak"] - frame["start_memory"])
+
+    def profiled(self, name: str):
+        """Decorator recording every call of the function as the phase name."""
+        def decorator(function):
+            @functools.wraps(function)
+            def wrapper(*args, **kwargs):
+                if not self.enabled:
+                    return function(*args, **kwargs)
+                with self.phase(name):
+                    return function(*args, **kwargs)
+            return wrapper
+        return decorator
+
+
+PROFILER = PhaseProfiler()
+
+
+def iim_recovery(matrix_nan: np.ndarray, adaptive_flag: bool = False, learning_neighbors: int = 10,
+                 workers: int = 1, neighbor_index: str = "auto", chunk_rows: int = None, dtype=np.float64,
+                 cache: "NeighborhoodCache" = None):
     """Implementation of the IIM algorithm
     Via the adaptive flag, the algorithm can be run in two modes:
     - Adaptive: The algorithm will run the adaptive version of the algorithm, as described in the paper
@@ -24,6 +129,23 @@ def iim_recovery(matrix_nan: np.ndarray, adaptive_flag: bool = False, learning_n
         Whether to use the adaptive version of the algorithm, by default False.
     learning_neighbors : int, optional
         The number of neighbors to use for the KNN classifier, by default 10.
+    workers : int, optional
+        The number of worker processes of the adaptive version, by default 1 (serial).
+        Only used together with the adaptive flag.
+    neighbor_index : str, optional
+        The neighbor index backend, one of "brute", "tree", "approximate" or "auto" (see make_neighbor_index),
+        by default "auto". The index is fitted once and shared by all stages.
+    chunk_rows : int, optional
+        The number of incomplete tuples recovered at once, by default all of them.
+        The models of a block are learned, applied and written into matrix_nan before the next block starts,
+        so the memory no longer grows with the number of incomplete tuples.
+    dtype : np.dtype, optional
+        The precision of the neighbor search, the learning and the imputation, by default float64.
+        With float32 the index and the model store take half the memory. The adaptive cost statistics
+        are always accumulated in float64 and matrix_nan keeps its own dtype.
+    cache : NeighborhoodCache, optional
+        The cache of the neighbor searches across recoveries, by default none.
+        Not used for the neighbors of the complete tuples in worker processes (workers other than 1).
 
     Returns
     -------
@@ -32,9 +154,8 @@ def iim_recovery(matrix_nan: np.ndarray, adaptive_flag: bool = False, learning_n
     """
     tuples_with_nan = np.isnan(matrix_nan).any(axis=1)
     if np.any(tuples_with_nan):  # if there are any tuples with missing values as NaN
-        incomplete_tuples_indices = np.array(np.where(tuples_with_nan == True))
-        incomplete_tuples = matrix_nan[tuples_with_nan]
-        complete_tuples = matrix_nan[~tuples_with_nan]  # Rows that do not contain a NaN value
+        incomplete_tuples_indices = np.flatnonzero(tuples_with_nan)
+        complete_tuples = matrix_nan[~tuples_with_nan].astype(dtype)  # Rows that do not contain a NaN value
         if learning_neighbors > len(complete_tuples):
             print("Warning: More learning neighbors than complete tuples, setting learning neighbors to number of complete tuples", file=sys.stderr)
             learning_neighbors = min(len(complete_tuples),
@@ -48,41 +169,429 @@ def iim_recovery(matrix_nan: np.ndarray, adaptive_flag: bool = False, learning_n
             nan_mask = np.isnan(matrix_nan)
             matrix_nan[nan_mask] = 0.0
             return matrix_nan
-        if adaptive_flag:
-            #print("Running IIM algorithm with adaptive algorithm, k = " + str(learning_neighbors) + "...")
-            lr_models = adaptive(complete_tuples, incomplete_tuples, learning_neighbors,
-                                 max_learning_neighbors=min(len(complete_tuples), 10))
-            imputation_result = imputation(incomplete_tuples, lr_models)
-
-        else:
-            #print("Running IIM algorithm with k = " + str(learning_neighbors) + "...")
-            lr_models = learning(complete_tuples, incomplete_tuples, learning_neighbors)
-            imputation_result = imputation(incomplete_tuples, lr_models)
-
-        # determine_rmse(imputation_result, incomplete_tuples_indices, matrix_nan)
-        # To ignore RMSE, uncomment the following lines and comment the above line
-        for result in imputation_result:
-            matrix_nan[np.array(incomplete_tuples_indices)[:, result[0]], result[1]] = result[2]
+        index = make_neighbor_index(complete_tuples, neighbor_index, cache)
+        block_size = chunk_rows or len(incomplete_tuples_indices)
+        statistics = None
+        if adaptive_flag and block_size < len(incomplete_tuples_indices):
+            # the neighborhoods of the complete tuples are the same for every block
+            statistics = neighborhood_statistics(complete_tuples, index.query_incomplete(complete_tuples, learning_neighbors))
+
+        for start in range(0, len(incomplete_tuples_indices), block_size):
+            rows = incomplete_tuples_indices[start:start + block_size]
+            incomplete_tuples = matrix_nan[rows].astype(dtype)
+            if adaptive_flag:
+                #print("Running IIM algorithm with adaptive algorithm, k = " + str(learning_neighbors) + "...")
+                if workers is not None and workers <= 1:
+                    lr_models = adaptive(complete_tuples, incomplete_tuples, learning_neighbors,
+                                         max_learning_neighbors=min(len(complete_tuples), 10), index=index,
+                                         statistics=statistics)
+                else:
+                    lr_models = adaptive_multi(complete_tuples, incomplete_tuples, learning_neighbors,
+                                               max_learning_neighbors=min(len(complete_tuples), 10), index=index,
+                                               statistics=statistics, workers=workers)
+                imputation_result = imputation(incomplete_tuples, lr_models)
+
+            else:
+                #print("Running IIM algorithm with k = " + str(learning_neighbors) + "...")
+                lr_models = learning(complete_tuples, incomplete_tuples, learning_neighbors, index)
+                imputation_result = imputation(incomplete_tuples, lr_models)
+
+            # determine_rmse(imputation_result, lr_models, rows, matrix_nan)
+            # To ignore RMSE, uncomment the following lines and comment the above line
+            matrix_nan[rows[lr_models.tuples], lr_models.attributes] = imputation_result
+            del incomplete_tuples, lr_models, imputation_result
         return matrix_nan
     else:
         print("No missing values as NaN, returning original matrix", file=sys.stderr)
         return matrix_nan
 
 
-def determine_rmse(imputation_result, incomplete_tuples_indices, matrix_nan):
-    individual_rmse = []
-
+def determine_rmse(imputation_result, lr_models, incomplete_tuples_indices, matrix_nan):
     complete_matrix = np.loadtxt("../Datasets/bafu/raw_matrices/BAFU_tiny.txt", delimiter=' ', )
-    for result in imputation_result:
-        matrix_nan[np.array(incomplete_tuples_indices)[:, result[0]], result[1]] = result[2]
-        individual_rmse.append((result[2] - complete_matrix[result[0], result[1]]) ** 2)
+    rows = incomplete_tuples_indices[lr_models.tuples]
+    matrix_nan[rows, lr_models.attributes] = imputation_result
+    individual_rmse = (imputation_result - complete_matrix[rows, lr_models.attributes]) ** 2
     global rmse
     rmse = np.sqrt(np.mean(individual_rmse))
     #print("RMSE: " + str(rmse))
 
 
+class IIMModels(NamedTuple):
+    """Learned IIM regression models stored as dense float tensors.
+
+    Models are kept per missing cell (an incomplete tuple and one of its missing attributes), so the store only
+    grows with the number of missing values and not with the full width of the incomplete tuples.
+    Every model is a Ridge fit on a single neighbor row, whose coefficients are zero (see learn_from_neighbors),
+    so a model is stored as its intercept alone.
+
+    Attributes
+    ----------
+    tuples : np.ndarray
+        Index of the incomplete tuple of each cell, shape (cells,).
+    attributes : np.ndarray
+        Index of the missing attribute of each cell, shape (cells,).
+    intercept : np.ndarray
+        Intercepts of the models, shape (cells, l).
+    valid : np.ndarray
+        Boolean mask of the models in use, shape (cells, l). Cells learned with fewer than l neighbors are padded.
+    """
+    tuples: np.ndarray
+    attributes: np.ndarray
+    intercept: np.ndarray
+    valid: np.ndarray
+
+
+
+class NeighborIndex(ABC):
+    """Euclidean nearest neighbor search over the complete tuples, on all attributes or on a subset of them.
+
+    One index is fitted per recovery and reused by every stage: the learning neighbors of the incomplete tuples
+    (searched on their observed attributes) and the neighbors of the complete tuples in the adaptive version.
+    The structure for a subset of attributes is built on first use and kept for the SUBSPACE_CACHE_SIZE most recently
+    used subsets. Subclasses implement _build and _search.
+
+    Parameters
+    ----------
+    complete_tuples : np.ndarray
+        The complete matrix of values without missing values.
+    cache : NeighborhoodCache, optional
+        The cache of the searches of query_incomplete across recoveries, by default none.
+    """
+
+    def __init__(self, complete_tuples: np.ndarray, cache: "NeighborhoodCache" = None):
+        self.complete_tuples = complete_tuples
+        self.cache = cache
+        self._cache_state = None
+        self._subspaces = OrderedDict()
+
+    @PROFILER.profiled("neighbor_search")
+    def query(self, queries: np.ndarray, k: int, observed: np.ndarray = None):
+        """Finds the k nearest complete tuples of every query.
+
+        Parameters
+        ----------
+        queries : np.ndarray
+            The query tuples, shape (queries, attributes). Only the observed attributes are read.
+        k : int
+            The number of neighbors to find, at most the number of complete tuples.
+        observed : np.ndarray, optional
+            Boolean mask of the attributes the distance is computed on, by default all of them.
+
+        Returns
+        -------
+        np.ndarray
+            The indices of the neighbors in complete_tuples, sorted by distance, shape (queries, k).
+        """
+        if observed is None:
+            observed = np.ones(self.complete_tuples.shape[1], dtype=bool)
+        key = observed.tobytes()
+        if key in self._subspaces:
+            self._subspaces.move_to_end(key)
+        else:
+            self._subspaces[key] = self._build(observed)
+            if len(self._subspaces) > SUBSPACE_CACHE_SIZE:
+                self._subspaces.popitem(last=False)
+        # the search gets all attributes, the unobserved ones set to 0
+        return self._search(self._subspaces[key], np.where(observed, queries, 0.0), k, observed)
+
+    def query_incomplete(self, incomplete_tuples: np.ndarray, k: int):
+        """Finds the k nearest complete tuples of every incomplete tuple, using only its observed attributes.
+
+        The incomplete tuples are grouped by their pattern of missing attributes and every group is searched in one batch.
+        A tuple without any observed attribute falls back to the distance to the origin over all attributes.
+
+        Parameters
+        ----------
+        incomplete_tuples : np.ndarray
+            The complete matrix of values with missing values in the form of NaN.
+        k : int
+            The number of neighbors to find.
+
+        Returns
+        -------
+        np.ndarray
+            The indices of the neighbors in complete_tuples, sorted by distance, shape (incomplete tuples, k).
+        """
+        if self.cache is not None:
+            return self.cache.query_incomplete(self, incomplete_tuples, k)
+        return self._query_incomplete(incomplete_tuples, k)
+
+    def _query_incomplete(self, incomplete_tuples: np.ndarray, k: int):
+        missing = np.isnan(incomplete_tuples)
+        patterns, pattern_of_tuple = np.unique(missing, axis=0, return_inverse=True)
+        pattern_of_tuple = pattern_of_tuple.reshape(-1)
+
+        incomplete_tuples_no_nan = np.nan_to_num(incomplete_tuples)
+        neighbors = np.empty((len(incomplete_tuples), k), dtype=np.intp)
+        for pattern, observed in enumerate(~patterns):
+            if not np.any(observed):
+                observed = np.ones_like(observed)
+            members = np.flatnonzero(pattern_of_tuple == pattern)
+            neighbors[members] = self.query(incomplete_tuples_no_nan[members], k, observed)
+        return neighbors
+
+    @abstractmethod
+    def _build(self, observed: np.ndarray):
+        """Returns the search structure of the complete tuples restricted to the observed attributes."""
+
+    @abstractmethod
+    def _search(self, subspace, queries: np.ndarray, k: int, observed: np.ndarray):
+        """Returns the indices of the k nearest complete tuples of every query in the structure built by _build."""
+
+
+class NeighborhoodCache:
+    """Cache of nearest neighbor searches across recoveries, e.g. of the ticks of a scenario imputed by one process.
+
+    Searches are stored by content: the key of a search is a hash of the query tuple (with its NaN values, so also of its
+    missing pattern) and its neighbors are stored as hashes of the complete tuples. A result is kept per set of complete
+    tuples and can be used by a later recovery whose complete tuples are a subset of that set: removing tuples never
+    brings others closer, so the surviving neighbors, in the same order, are still the nearest ones. Ticks that add
+    missing values to more tuples therefore only search again for the tuples that changed or lost too many neighbors.
+    The learned models only depend on the neighbors, so they are derived from the cached neighbors without a search.
+
+    Sets of complete tuples are evicted least recently used first as soon as the cache holds more than max_bytes.
+
+    Parameters
+    ----------
+    max_bytes : int, optional
+        The size limit of the cache, by default DEFAULT_CACHE_BYTES.
+    """
+
+    def __init__(self, max_bytes: int = None):
+        self.max_bytes = DEFAULT_CACHE_BYTES if max_bytes is None else max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._generations = OrderedDict()  # (index kind, hash of the complete tuples) -> {"rows", "searches", "bytes"}
+
+    def query_incomplete(self, index: NeighborIndex, tuples: np.ndarray, k: int):
+        """NeighborIndex.query_incomplete through the cache, only the missing searches are run on the index."""
+        state = self._attach(index)
+        query_hashes = row_hashes(tuples)
+        neighbors = np.empty((len(tuples), k), dtype=np.intp)
+        found = np.zeros(len(tuples), dtype=bool)
+
+        for generation in state["usable"]:
+            for i in np.flatnonzero(~found):
+                cached = generation["searches"].get(int(query_hashes[i]))
+                if cached is None:
+                    continue
+                positions = state["position"](cached)
+                positions = positions[positions >= 0]
+                if len(positions) >= k:
+                    neighbors[i] = positions[:k]
+                    found[i] = True
+        self.hits += int(np.count_nonzero(found))
+
+        missed = np.flatnonzero(~found)
+        self.misses += len(missed)
+        if len(missed):
+            neighbors[missed] = index._query_incomplete(tuples[missed], k)
+            current = state["current"]
+            for i in missed:
+                current["searches"][int(query_hashes[i])] = state["hashes"][neighbors[i]]
+            added = len(missed) * (k * 8 + CACHE_ENTRY_OVERHEAD)
+            current["bytes"] += added
+            self._evict(keep=current)
+        return neighbors
+
+    def _attach(self, index: NeighborIndex):
+        """Registers the complete tuples of the index as the current generation and finds the usable generations."""
+        if index._cache_state is not None:
+            return index._cache_state
+
+        hashes = row_hashes(index.complete_tuples)
+        kind = (type(index).__name__, index.complete_tuples.dtype.str, index.complete_tuples.shape[1])
+        key = (kind, hashlib.blake2b(np.sort(hashes).tobytes(), digest_size=16).hexdigest())
+        if key not in self._generations:
+            self._generations[key] = {"rows": np.unique(hashes), "searches": {}, "bytes": hashes.nbytes}
+        self._generations.move_to_end(key)
+        current = self._generations[key]
+
+        # generations of supersets of the current complete tuples, most recently used first
+        usable = [generation for other, generation in reversed(self._generations.items())
+                  if other[0] == kind and np.all(np.isin(current["rows"], generation["rows"], assume_unique=True))]
+
+        order = np.argsort(hashes, kind='stable')
+        sorted_hashes = hashes[order]
+
+        def position(cached_hashes: np.ndarray):
+            """Positions of the tuples with the given hashes in the current complete tuples, -1 if they are gone."""
+            slots = np.minimum(np.searchsorted(sorted_hashes, cached_hashes), len(sorted_hashes) - 1)
+            return np.where(sorted_hashes[slots] == cached_hashes, order[slots], -1)
+
+        index._cache_state = {"current": current, "usable": usable, "hashes": hashes, "position": position}
+        self._evict(keep=current)
+        return index._cache_state
+
+    def _evict(self, keep: dict):
+        total = sum(generation["bytes"] for generation in self._generations.values())
+        for key in list(self._generations):
+            if total <= self.max_bytes:
+                break
+            if self._generations[key] is not keep:
+                total -= self._generations.pop(key)["bytes"]
+
+
+def row_hashes(rows: np.ndarray):
+    """64-bit content hash of every row: a multiply-add hash of the bit patterns of its values (NaN included)."""
+    rows = np.ascontiguousarray(rows)
+    bits = rows.view(np.uint64 if rows.dtype.itemsize == 8 else np.uint32).astype(np.uint64)
+    multipliers = np.random.default_rng(0x11A).integers(1, 2 ** 63, size=rows.shape[1], dtype=np.uint64) * 2 + 1
+    hashes = (bits * multipliers).sum(axis=1, dtype=np.uint64)
+    return hashes ^ (hashes >> np.uint64(31))
+
+
+_shared_cache = {}
+
+
+def shared_neighborhood_cache(max_megabytes: int = None):
+    """The neighborhood cache of this process, created on first use, e.g. kept by a server across its requests."""
+    max_bytes = DEFAULT_CACHE_BYTES if max_megabytes is None else max_megabytes << 20
+    cache = _shared_cache.setdefault("cache", NeighborhoodCache(max_bytes))
+    cache.max_bytes = max_bytes
+    return cache
+
+
+class BruteNeighborIndex(NeighborIndex):
+    """Exact search by blocked matrix products (BLAS) against the complete tuples.
+    Attribute subsets only need the squared norms of the complete tuples over the subset, the data is not copied."""
+
+    def _build(self, observed: np.ndarray):
+        return np.einsum('ij,ij,j->i', self.complete_tuples, self.complete_tuples, observed.astype(self.complete_tuples.dtype))
+
+    def _search(self, subspace, queries: np.ndarray, k: int, observed: np.ndarray):
+        index, index_norms = self.complete_tuples, subspace
+        neighbors = np.empty((len(queries), k), dtype=np.intp)
+        block = max(1, NEIGHBOR_BLOCK_ELEMENTS // len(index))
+        for start in range(0, len(queries), block):
+            rows = queries[start:start + block]
+            distances = np.einsum('ij,ij->i', rows, rows)[:, None] - 2 * rows @ index.T + index_norms
+            neighbors[start:start + block] = smallest_indices(distances, k)
+        return neighbors
+
+
+class TreeNeighborIndex(NeighborIndex):
+    """Exact search with a KD tree, or with a ball tree if more than TREE_KD_MAX_ATTRIBUTES attributes are used."""
+
+    def _build(self, observed: np.ndarray):
+        tree = KDTree if np.count_nonzero(observed) <= TREE_KD_MAX_ATTRIBUTES else BallTree
+        return tree(self.complete_tuples[:, observed])
+
+    def _search(self, subspace, queries: np.ndarray, k: int, observed: np.ndarray):
+        return subspace.query(queries[:, observed], k=k, return_distance=False)
+
+
+class ProjectionNeighborIndex(NeighborIndex):
+    """Approximate search for very large inputs: a KD tree over a Gaussian random projection of the attributes
+    proposes oversampling * k candidates, which are then re-ranked by their exact distance.
+
+    The recall against the exact search depends on the missing pattern. Measured with benchmark_iim.py on its
+    synthetic series (5% missing, k = 3 and 10): tuples missing a single random value reach 0.95-1.0, tuples with
+    several random missing values drop to 0.63-0.86 from 20 attributes on, and blocks of consecutive missing rows
+    only reach 0.12-0.41. Use it for single missing values or check the recall first (benchmark_iim.py --backends
+    approximate).
+
+    Parameters
+    ----------
+    complete_tuples : np.ndarray
+        The complete matrix of values without missing values.
+    cache : NeighborhoodCache, optional
+        The cache of the searches of query_incomplete across recoveries, by default none.
+    dimensions : int, optional
+        The number of projected dimensions, by default 8. Subsets with fewer attributes are not projected.
+    oversampling : int, optional
+        The number of candidates per requested neighbor, by default 4.
+    seed : int, optional
+        The seed of the projection, by default 0.
+    """
+
+    def __init__(self, complete_tuples: np.ndarray, cache: NeighborhoodCache = None, dimensions: int = 8,
+                 oversampling: int = 4, seed: int = 0):
+        super().__init__(complete_tuples, cache)
+        self.oversampling = oversampling
+        self.projection = np.random.default_rng(seed).normal(size=(complete_tuples.shape[1], dimensions))
+        self.projection = self.projection.astype(complete_tuples.dtype)
+
+    def _build(self, observed: np.ndarray):
+        projection = self.projection[observed] if np.count_nonzero(observed) > self.projection.shape[1] else None
+        index = self.complete_tuples[:, observed]
+        return KDTree(index if projection is None else index @ projection), projection
+
+    def _search(self, subspace, queries: np.ndarray, k: int, observed: np.ndarray):
+        tree, projection = subspace
+        queries = queries[:, observed]
+        if projection is None:
+            return tree.query(queries, k=k, return_distance=False)
+
+        candidates = tree.query(queries @ projection, k=min(k * self.oversampling, tree.data.shape[0]),
+                                return_distance=False)
+        candidate_rows = self.complete_tuples[candidates][:, :, observed]  # (queries, candidates, attributes)
+        distances = np.sum((candidate_rows - queries[:, None, :]) ** 2, axis=2)
+        return np.take_along_axis(candidates, smallest_indices(distances, k), axis=1)
+
+
+NEIGHBOR_INDEX_BACKENDS = {
+    "brute": BruteNeighborIndex,
+    "tree": TreeNeighborIndex,
+    "approximate": ProjectionNeighborIndex,
+}
+
+
+NEIGHBOR_INDEX_FLAGS = {"b": "brute", "t": "tree", "x": "approximate"}
+
+
+def make_neighbor_index(complete_tuples: np.ndarray, backend: str = "auto", cache: NeighborhoodCache = None):
+    """Fits the neighbor index of a recovery.
+
+    Parameters
+    ----------
+    complete_tuples : np.ndarray
+        The complete matrix of values without missing values.
+    backend : str, optional
+        One of "brute", "tree", "approximate" or "auto", by default "auto".
+        Auto always searches exactly: trees for large inputs with at most TREE_KD_MAX_ATTRIBUTES attributes and
+        brute-force search otherwise. The approximate search is only used when asked for (the x flag), its recall
+        depends on the missing pattern (see ProjectionNeighborIndex).
+    cache : NeighborhoodCache, optional
+        The cache of the searches across recoveries, by default none.
+
+    Returns
+    -------
+    NeighborIndex
+        The fitted index.
+    """
+    if backend == "auto":
+        if len(complete_tuples) >= TREE_MIN_TUPLES and complete_tuples.shape[1] <= TREE_KD_MAX_ATTRIBUTES:
+            backend = "tree"
+        else:
+            backend = "brute"
+    if backend not in NEIGHBOR_INDEX_BACKENDS:
+        raise ValueError("Unknown neighbor index backend: " + backend)
+    return NEIGHBOR_INDEX_BACKENDS[backend](complete_tuples, cache)
+
+
+def neighbor_recall(neighbors: np.ndarray, exact_neighbors: np.ndarray):
+    """Recall of a neighbor search against the exact search: the mean fraction of the exact neighbors that were found.
+
+    Parameters
+    ----------
+    neighbors : np.ndarray
+        The neighbors to evaluate, shape (queries, k).
+    exact_neighbors : np.ndarray
+        The exact neighbors of the same queries, shape (queries, k).
+
+    Returns
+    -------
+    float
+        The recall, between 0 and 1.
+    """
+    found = (neighbors[:, :, None] == exact_neighbors[:, None, :]).any(axis=1)
+    return float(np.mean(found))
+
+
 #  Algorithm 1: Learning
-def learning(complete_tuples: np.ndarray, incomplete_tuples: np.ndarray, l: int = 10):
+@PROFILER.profiled("learning")
+def learning(complete_tuples: np.ndarray, incomplete_tuples: np.ndarray, l: int = 10, index: NeighborIndex = None):
     """Learns individual regression models for each learning neighbor and each attribute,
        by fitting on the other attributes and the missing attribute
 
@@ -96,130 +605,128 @@ def learning(complete_tuples: np.ndarray, incomplete_tuples: np.ndarray, l: int
         Should already be normalized.
     l : int, optional
         The number of neighbors to use for the KNN classifier, by default 10.
+    index : NeighborIndex, optional
+        The neighbor index fitted on complete_tuples, by default a new one.
 
     Returns
     -------
-    model_params: np.ndarray[Ridge]
-        The learned regression models. The structure of this array is as follows:
-        - First dimension: which tuple we are looking at
-        - Second dimension: which attribute we are looking at
-        - Third dimension: which learning neighbor we are looking at
+    model_params: IIMModels
+        The learned regression models, one set of l models for every missing cell of the incomplete tuples.
     """
 
-    knn_euc = NearestNeighbors(n_neighbors=l, metric='euclidean').fit(complete_tuples)
-    number_of_attributes = incomplete_tuples.shape[1]  # Number of attributes, should be 12
-    model_params = np.empty((len(incomplete_tuples), number_of_attributes, l), dtype=object)
-
-    # Replace NaN values with 0
-    incomplete_tuples_no_nan = np.nan_to_num(incomplete_tuples)
+    # Find the k nearest neighbors of all incomplete tuples, on their observed attributes only
+    if index is None:
+        index = make_neighbor_index(complete_tuples)
+    learning_neighbors = index.query_incomplete(incomplete_tuples, l)
+    return learn_from_neighbors(complete_tuples, incomplete_tuples, learning_neighbors)
 
-    # Find the k nearest neighbors for all incomplete tuples at once
-    learning_neighbors = knn_euc.kneighbors(incomplete_tuples_no_nan, return_distance=False)
 
-    for tuple_index, incomplete_tuple in enumerate(incomplete_tuples):
-        nan_indicator = np.isnan(incomplete_tuple)
+def learn_from_neighbors(complete_tuples: np.ndarray, incomplete_tuples: np.ndarray, learning_neighbors: np.ndarray):
+    """Learning of Algorithm 1 once the neighbors are known: only the neighbor rows of complete_tuples are read.
 
-        # Check if there is more than one NaN value in the tuple
-        if np.count_nonzero(nan_indicator) == 1:
-            nan_index = np.where(nan_indicator)[0][0]  # Get the index of the NaN value
-
-            # Learn the relevant value/column
-            X = complete_tuples[learning_neighbors[tuple_index]][:, ~nan_indicator]
-            y = complete_tuples[learning_neighbors[tuple_index]][:, nan_indicator]
-            models = [Ridge(tol=1e-20).fit(X_i.reshape(1, -1), y_i) for X_i, y_i in zip(X, y)]
-            model_params[tuple_index, nan_index] = [(model.coef_, model.intercept_) for model in models]
-        else:
-            # If there are multiple NaNs in the tuple
-            for missing_value_index in np.where(nan_indicator)[0]:
-                # Create a new indicator for this specific NaN
-                current_nan_indicator = np.zeros_like(nan_indicator)
-                current_nan_indicator[missing_value_index] = True
-
-                # Learn the relevant value/column
-                X = complete_tuples[learning_neighbors[tuple_index]][:, ~current_nan_indicator]
-                y = complete_tuples[learning_neighbors[tuple_index]][:, current_nan_indicator]
-                models = [Ridge(tol=1e-20).fit(X_i.reshape(1, -1), y_i) for X_i, y_i in zip(X, y)]
-                model_params[tuple_index, missing_value_index] = [(model.coef_, model.intercept_) for model in models]
+    Parameters
+    ----------
+    complete_tuples : np.ndarray
+        The complete matrix of values without missing values.
+    incomplete_tuples : np.ndarray
+        The complete matrix of values with missing values in the form of NaN.
+    learning_neighbors : np.ndarray
+        The indices of the learning neighbors in complete_tuples, shape (incomplete tuples, l).
 
-    return model_params
+    Returns
+    -------
+    model_params: IIMModels
+        The learned regression models, one set of l models for every missing cell of the incomplete tuples.
+    """
+    # Every (tuple, missing attribute, neighbor) model is Ridge(alpha=1) fit on the single neighbor row:
+    # the target is the missing attribute of the neighbor, the features are all of its other attributes.
+    # With fit_intercept the data is centered first, and the centered design of a single sample is all zeros,
+    # so the normal equations (X_c^T X_c + alpha * I) w = X_c^T y_c collapse to alpha * w = 0: the coefficients
+    # are zero and the intercept y_mean - x_mean @ w is the target itself, exactly what sklearn returns.
+    # Only the targets are gathered, the features of the neighbors are never read.
+    tuple_indices, attribute_indices = np.nonzero(np.isnan(incomplete_tuples))
+    intercepts = complete_tuples[learning_neighbors[tuple_indices], attribute_indices[:, None]]  # (cells, l)
+
+    return IIMModels(tuple_indices, attribute_indices, intercepts, np.ones(intercepts.shape, dtype=bool))
+
+
+def smallest_indices(distances: np.ndarray, l: int):
+    """Indices of the l smallest entries of every row, in ascending order of the entries."""
+    if l < distances.shape[1]:
+        candidates = np.argpartition(distances, l - 1, axis=1)[:, :l]
+    else:
+        candidates = np.broadcast_to(np.arange(distances.shape[1]), distances.shape)
+    order = np.argsort(np.take_along_axis(distances, candidates, axis=1), axis=1, kind='stable')
+    return np.take_along_axis(candidates, order, axis=1)
 
 
 # Algorithm 2: Imputation
-def imputation(incomplete_tuples: np.ndarray, lr_coef_and_threshold: np.ndarray):
+@PROFILER.profiled("imputation")
+def imputation(incomplete_tuples: np.ndarray, lr_coef_and_threshold: IIMModels):
     """ Imputes the missing values of the incomplete tuples using the learned linear regression models.
+    All candidate suggestions of all missing cells are evaluated in a single pass over the model store.
 
     Parameters
     ----------
     incomplete_tuples : np.ndarray
         The complete matrix of values with missing values in the form of NaN.
         Should already be normalized.
-    lr_coef_and_threshold : np.ndarray[Ridge]
-        The learned regression models containing the coefficients and intercepts.
+    lr_coef_and_threshold : IIMModels
+        The learned regression models. Their coefficients are zero, so the suggestions are their intercepts
+        and do not depend on the observed values of the tuples.
 
     Returns
     -------
-    imputed_values : list[list[int, int, float]]
-        Returns the imputed values in the form of a list of lists,
-        where each list contains the tuple index, the attribute index and the imputed value.
+    imputed_values : np.ndarray
+        The imputed value of every missing cell, aligned with the cells of the model store
+        (lr_coef_and_threshold.tuples and lr_coef_and_threshold.attributes).
     """
-    imputed_values = []
-
-    # For each missing tuple
-    for i, incomplete_tuple in enumerate(incomplete_tuples):  # for t_i in r
-        nan_indicator = np.isnan(incomplete_tuple)  # show which attribute is missing as NaN
-
-        # Check if there is more than one NaN value in the tuple
-        if np.count_nonzero(nan_indicator) == 1:
-            missing_attributes_indices = np.where(nan_indicator)[0]  # indices of missing attributes
-
-            # Prepare the input array for multiple samples
-            incomplete_tuple_no_nan = incomplete_tuple[~nan_indicator]
+    # Predict the missing values using the learned Ridge models, padded models don't take part
+    candidate_suggestions = np.where(lr_coef_and_threshold.valid, lr_coef_and_threshold.intercept, 0.0)
 
-            # For each missing attribute
-            for missing_attribute_index in missing_attributes_indices:
-                # Predict the missing values using the learned Ridge models
-                candidate_suggestions = np.array([coef @ incomplete_tuple_no_nan + intercept for coef, intercept in
-                                                  lr_coef_and_threshold[i, missing_attribute_index]])
+    _, weights = candidate_weights(candidate_suggestions, lr_coef_and_threshold.valid)
+    return np.einsum('cl,cl->c', candidate_suggestions, weights)
 
-                distances = compute_distances(candidate_suggestions)
-                weights = compute_weights(distances)
 
-                impute_result = np.sum(candidate_suggestions * weights)
-                # Create tuple with index (in missing tuples), attribute, imputed value
-                imputed_values.append([i, missing_attribute_index, impute_result])
-        else:
-
-            missing_attributes_indices = np.where(nan_indicator)[0]  # indices of missing attributes
-            # If there are multiple NaNs in the tuple
-            for missing_value_index in np.where(nan_indicator)[0]:
-                # Create a new indicator for this specific NaN
-                current_nan_indicator = np.zeros_like(nan_indicator)
-                current_nan_indicator[missing_value_index] = True
-
-                # Prepare the input array for multiple samples
-                incomplete_tuple_no_nan = np.nan_to_num(incomplete_tuple[~current_nan_indicator])
-
-                # For each missing attribute
-                for missing_attribute_index in missing_attributes_indices:
-                    # Predict the missing values using the learned Ridge models
-                    candidate_suggestions = np.array([coef @ incomplete_tuple_no_nan + intercept for coef, intercept in
-                                                      lr_coef_and_threshold[i, missing_attribute_index]])
+class NeighborhoodStatistics(NamedTuple):
+    """Sufficient statistics of all (t_i, neighbor of t_i) pairs over the complete tuples, for the adaptive cost.
 
-                    distances = compute_distances(candidate_suggestions)
-                    weights = compute_weights(distances)
+    The cost of a model (w, b) for attribute a is the sum over all pairs of (t_i[a] - w . x[-a] - b)^2,
+    where x is the neighbor and x[-a] are all its attributes except a. The learned coefficients w are zero
+    (see IIMModels), so expanding the square, this sum only depends on the moments of the targets t_i below
+    and can be evaluated for any number of models without revisiting the pairs.
+    All moments are computed on data centered by the column means to limit cancellation.
 
-                    impute_result = np.sum(candidate_suggestions * weights)
-                    # Create tuple with index (in missing tuples), attribute, imputed value
-                    imputed_values.append([i, missing_attribute_index, impute_result])
-
-    return imputed_values
+    Attributes
+    ----------
+    means : np.ndarray
+        Column means used for centering, shape (attributes,).
+    count : int
+        Number of pairs.
+    neighbors_per_tuple : int
+        Number of neighbors of each complete tuple (k).
+    target_sum : np.ndarray
+        Sum of t_i over the pairs, shape (attributes,).
+    target_square_sum : np.ndarray
+        Sum of t_i ** 2 over the pairs, shape (attributes,).
+    """
+    means: np.ndarray
+    count: int
+    neighbors_per_tuple: int
+    target_sum: np.ndarray
+    target_square_sum: np.ndarray
 
 
 # Algorithm 3: Adaptive
+@PROFILER.profiled("adaptive")
 def adaptive(complete_tuples: np.ndarray, incomplete_tuples: np.ndarray, k: int, max_learning_neighbors: int = 100,
-             step_size: int = 4):
+             step_size: int = 4, index: NeighborIndex = None, statistics: NeighborhoodStatistics = None):
     """Adaptive learning of regression parameters
 
+    The candidate neighborhoods are nested: the l nearest neighbors are a prefix of the (l + step_size) nearest ones,
+    and every model only depends on its own neighbor. The models are therefore learned once for the largest candidate l,
+    and the model set of every smaller l is the corresponding prefix of the learned models.
+
     Parameters
     ----------
     complete_tuples : np.ndarray
@@ -234,158 +741,581 @@ def adaptive(complete_tuples: np.ndarray, incomplete_tuples: np.ndarray, k: int,
         The maximum number of neighbors to use for the learning phase, by default 100.
     step_size : int, optional
         The step size for the learning phase, by default 3.
+    index : NeighborIndex, optional
+        The neighbor index fitted on complete_tuples, by default a new one.
+    statistics : NeighborhoodStatistics, optional
+        The statistics of the k nearest neighbors of the complete tuples, by default computed here.
+        Chunked recoveries compute them once for all blocks.
 
     Returns
     -------
-    phi: np.ndarray[Ridge]
+    phi: IIMModels
         The learned regression parameters for all tuples in r.
     """
     #print("Starting Algorithm 3 'adaptive'")
-    all_entries = min(int(complete_tuples.shape[0]), max_learning_neighbors)
-    phi_list = [learning(complete_tuples, incomplete_tuples, l_learning)  # for l in 1..n
-                for l_learning in
-                range(1, all_entries + 1, step_size)]
-    nn = NearestNeighbors(n_neighbors=k, metric='euclidean').fit(complete_tuples)
-    number_of_models = max(len(phi_list) - 1, 1)
-    number_of_incomplete_tuples = len(incomplete_tuples)
-    costs = np.zeros((number_of_incomplete_tuples, number_of_models))
+    candidate_sizes = adaptive_candidate_sizes(complete_tuples, max_learning_neighbors, step_size)
+    number_of_models = max(len(candidate_sizes) - 1, 1)
+    candidate_sizes = candidate_sizes[:number_of_models]
+    if index is None:
+        index = make_neighbor_index(complete_tuples)
+    phi = learning(complete_tuples, incomplete_tuples, candidate_sizes[-1], index)  # for l in 1..n, as prefixes
     #print("Finished learning; Starting main loop of Algorithm 3 'adaptive'")
-    for log, complete_tuple in enumerate(complete_tuples, 1):  # for t_i in r
-        #if (log % 50) == 0: print("Algorithm 3 'adaptive', processing tuple {}".format(str(log)))
-        neighbors = nn.kneighbors(complete_tuple.reshape(1, -1), return_distance=False)[0]
-        for incomplete_tuple_idx, incomplete_tuple in enumerate(incomplete_tuples):
-            nan_indicator = np.isnan(incomplete_tuple)  # Show which attribute is missing as NaN
-            neighbors_filtered = np.delete(complete_tuples[neighbors], nan_indicator, axis=1)
-            for l in range(0, number_of_models):  # Line 6, for l in 1..n
-                model_params_for_tuple = phi_list[l][incomplete_tuple_idx]
-                for attribute_index, model_params in enumerate(model_params_for_tuple):
-                    #print(f"Attribute index: {attribute_index}, model_params: {model_params}")
-
-                    if model_params is not None and not np.any(
-                            model_params == None):  # Only compute cost for NaN attributes
-                        coefs, intercepts = zip(*model_params)
-                        expanded_coef = np.array(coefs)
-                        # set NaN attributes in neighbors_filtered to 0 (Nan to Num should also work)
-                        neighbors_filtered_copy = np.nan_to_num(neighbors_filtered)
-
-                        #print(expanded_coef.shape, neighbors_filtered_copy.shape)
-                        phi_models = (expanded_coef @ neighbors_filtered_copy[:, :, None]).squeeze() + np.array(
-                            intercepts)
-                        errors = np.abs(complete_tuple[attribute_index] - phi_models)
-                        costs[incomplete_tuple_idx, l] += np.sum(np.power(errors, 2)) / len(phi_models)
+
+    # Neighbors of every t_i in r, queried at once
+    if statistics is None:  # a single pattern without missing attributes, through the neighborhood cache if any
+        statistics = neighborhood_statistics(complete_tuples, index.query_incomplete(complete_tuples, k))
+    costs = adaptive_costs(phi, statistics, candidate_sizes, len(incomplete_tuples))
 
     # Line 8-10 Select best model for each tuple
     best_models_indices = np.argmin(costs, axis=1)
-    learning_neighbors = [range(1, all_entries + 1, step_size)[best_models_index]
-                          for best_models_index in best_models_indices]
+    learning_neighbors = candidate_sizes[best_models_indices]
     #print("Determined following learning neighbors for each tuple with missing attributes: {}".format(learning_neighbors))
-    # Organizing the model parameters into a numpy array
-    number_of_attributes = incomplete_tuples.shape[1]
-    lr_models = np.empty((number_of_incomplete_tuples, number_of_attributes, l), dtype=object)
-
-    for i in range(number_of_incomplete_tuples):
-        best_models_indices_for_tuple = best_models_indices[i]
-        lr_models[i] = phi_list[best_models_indices_for_tuple][i]
-
-    return lr_models
-
-
-def compute_cost_for_tuple(args):
-    complete_tuple, log, complete_tuples, incomplete_tuples, nn, number_of_models, phi_list = args
-    #if (log % 50) == 0: print("Algorithm 3 'adaptive', processing tuple {}".format(str(log)))
-    neighbors = nn.kneighbors(complete_tuple.reshape(1, -1), return_distance=False)[0]
-    costs = np.zeros((len(incomplete_tuples), number_of_models))
-    for incomplete_tuple_idx, incomplete_tuple in enumerate(incomplete_tuples):
-        nan_indicator = np.isnan(incomplete_tuple)
-        neighbors_filtered = np.delete(complete_tuples[neighbors], nan_indicator, axis=1)
-        for l in range(0, number_of_models):
-            # TODO Find a way to do this with expanded coef better if adaptive is of interest
-            expanded_coef = np.array([coef for coef, _ in phi_list[l][incomplete_tuple_idx]])
-            phi_models = (expanded_coef @ neighbors_filtered[:, :, None]).squeeze() + np.array(
-                [intercept for _, intercept in phi_list[l][incomplete_tuple_idx]])
-            errors = np.abs(complete_tuple[nan_indicator] - phi_models)
-            costs[incomplete_tuple_idx, l] += np.sum(np.power(errors, 2)) / len(phi_list[l][incomplete_tuple_idx])
+    return select_models(phi, learning_neighbors)
+
+
+def neighborhood_statistics(complete_tuples: np.ndarray, neighbors: np.ndarray):
+    """Computes the moments of all (t_i, neighbor of t_i) pairs needed by the adaptive cost.
+
+    Parameters
+    ----------
+    complete_tuples : np.ndarray
+        The complete matrix of values without missing values.
+    neighbors : np.ndarray
+        The indices of the k nearest complete tuples of every complete tuple, shape (complete tuples, k).
+
+    Returns
+    -------
+    NeighborhoodStatistics
+        The moments of the pairs.
+    """
+    complete_tuples = complete_tuples.astype(np.float64, copy=False)  # sums over all pairs, also for float32 runs
+    means = np.mean(complete_tuples, axis=0)
+    centered = complete_tuples - means
+    k = neighbors.shape[1]
+
+    return NeighborhoodStatistics(
+        means=means,
+        count=neighbors.size,
+        neighbors_per_tuple=k,
+        target_sum=k * np.sum(centered, axis=0),
+        target_square_sum=k * np.sum(centered ** 2, axis=0),
+    )
+
+
+def adaptive_costs(phi: IIMModels, statistics: NeighborhoodStatistics, candidate_sizes: np.ndarray,
+                   number_of_incomplete_tuples: int):
+    """Evaluates the adaptive cost of every candidate neighborhood of every incomplete tuple at once.
+
+    Parameters
+    ----------
+    phi : IIMModels
+        The models learned for the largest candidate neighborhood.
+    statistics : NeighborhoodStatistics
+        The moments of the (t_i, neighbor of t_i) pairs.
+    candidate_sizes : np.ndarray
+        The candidate numbers of learning neighbors, the costs of their prefixes are returned.
+    number_of_incomplete_tuples : int
+        The number of incomplete tuples.
+
+    Returns
+    -------
+    costs : np.ndarray
+        The cost of every candidate neighborhood, shape (incomplete tuples, candidates).
+    """
+    costs = np.zeros((number_of_incomplete_tuples, len(candidate_sizes)))
+    np.add.at(costs, phi.tuples, adaptive_cell_costs(phi, statistics, candidate_sizes))
     return costs
 
 
+def adaptive_cell_costs(phi: IIMModels, statistics: NeighborhoodStatistics, candidate_sizes: np.ndarray):
+    """Evaluates the adaptive cost of every candidate neighborhood of every missing cell.
+    Cells are independent of each other, so any slice of the model store can be evaluated on its own.
+
+    Parameters
+    ----------
+    phi : IIMModels
+        The models learned for the largest candidate neighborhood.
+    statistics : NeighborhoodStatistics
+        The moments of the (t_i, neighbor of t_i) pairs.
+    candidate_sizes : np.ndarray
+        The candidate numbers of learning neighbors, the costs of their prefixes are returned.
+
+    Returns
+    -------
+    costs : np.ndarray
+        The cost of every candidate neighborhood, shape (cells, candidates).
+    """
+    # the intercepts moved to centered data
+    intercepts = phi.intercept - statistics.means[phi.attributes][:, None]
+
+    # sum over the pairs of (t[a] - w . x - b)^2, expanded; the coefficients w are zero (see IIMModels)
+    errors = (statistics.target_square_sum[phi.attributes][:, None]
+              - 2 * intercepts * statistics.target_sum[phi.attributes][:, None]
+              + statistics.count * intercepts ** 2)
+    np.maximum(errors, 0.0, out=errors)  # clip the rounding noise of a zero error
+
+    # Line 6, for l in 1..n: the cost of a prefix is the running sum of the cost of its models
+    model_costs = np.cumsum(np.where(phi.valid, errors, 0.0) / statistics.neighbors_per_tuple, axis=1)
+    return model_costs[:, candidate_sizes - 1]
+
+
+def adaptive_candidate_sizes(complete_tuples: np.ndarray, max_learning_neighbors: int, step_size: int):
+    """The candidate numbers of learning neighbors l of the adaptive algorithm, in ascending order.
+
+    Parameters
+    ----------
+    complete_tuples : np.ndarray
+        The complete matrix of values without missing values.
+    max_learning_neighbors : int
+        The maximum number of neighbors to use for the learning phase.
+    step_size : int
+        The step size between two candidates.
+
+    Returns
+    -------
+    np.ndarray
+        The candidate numbers of learning neighbors.
+    """
+    all_entries = min(int(complete_tuples.shape[0]), max_learning_neighbors)
+    return np.arange(1, all_entries + 1, step_size)
+
+
+def select_models(phi: IIMModels, learning_neighbors: np.ndarray):
+    """Restricts the models of every incomplete tuple to the prefix of its selected neighborhood.
+
+    Parameters
+    ----------
+    phi : IIMModels
+        The models learned for the largest candidate neighborhood.
+    learning_neighbors : np.ndarray
+        The selected number of learning neighbors, for each incomplete tuple.
+
+    Returns
+    -------
+    IIMModels
+        The selected models, trimmed to the widest selected neighborhood and masked accordingly.
+    """
+    widest = int(np.max(learning_neighbors, initial=1))
+    valid = phi.valid[:, :widest] & (np.arange(widest) < learning_neighbors[phi.tuples][:, None])
+    return IIMModels(phi.tuples, phi.attributes, phi.intercept[:, :widest], valid)
+
+
+class SharedArrays:
+    """NumPy arrays placed in multiprocessing.shared_memory, so worker processes can use them without copies.
+
+    The parent process creates the arrays and hands the specifications (see specs) to the workers,
+    which attach them with attach_shared_arrays. All blocks are released when the context is left.
+    """
+
+    def __init__(self):
+        self._blocks = []
+        self.specs = {}
+
+    def empty(self, name: str, shape: tuple, dtype):
+        """Creates an uninitialized shared array."""
+        dtype = np.dtype(dtype)
+        block = shared_memory.SharedMemory(create=True, size=max(int(np.prod(shape)) * dtype.itemsize, 1))
+        self._blocks.append(block)
+        self.specs[name] = (block.name, tuple(shape), dtype.str)
+        return np.ndarray(shape, dtype=dtype, buffer=block.buf)
+
+    def put(self, name: str, array: np.ndarray):
+        """Creates a shared copy of an array."""
+        shared = self.empty(name, array.shape, array.dtype)
+        shared[...] = array
+        return shared
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        for block in self._blocks:
+            try:
+                block.close()
+            except BufferError:
+                pass  # views of the block are still alive in the caller, the mapping goes away with them
+            block.unlink()
+        self._blocks = []
+
+
+def attach_shared_arrays(specs: dict):
+    """Attaches the shared arrays created by SharedArrays in another process.
+
+    Parameters
+    ----------
+    specs : dict
+        The specifications of the arrays (SharedArrays.specs).
+
+    Returns
+    -------
+    arrays : dict
+        The arrays by name.
+    blocks : list
+        The attached shared memory blocks, they have to be kept alive as long as the arrays are used.
+    """
+    arrays, blocks = {}, []
+    for name, (block_name, shape, dtype) in specs.items():
+        # pool workers share the resource tracker of the creating process, which unlinks the block in the end
+        block = shared_memory.SharedMemory(name=block_name)
+        blocks.append(block)
+        arrays[name] = np.ndarray(shape, dtype=dtype, buffer=block.buf)
+    return arrays, blocks
+
+
+_adaptive_worker = {}
+
+
+def _attach_adaptive_worker(specs: dict, index: NeighborIndex, k: int, candidate_sizes: np.ndarray):
+    """Pool initializer of adaptive_multi: attaches the shared arrays once per worker process."""
+    arrays, blocks = attach_shared_arrays(specs)
+    _adaptive_worker.update(arrays=arrays, blocks=blocks, index=index, k=k, candidate_sizes=candidate_sizes)
+
+
+def _adaptive_neighbors_chunk(bounds: tuple):
+    """Work unit of adaptive_multi: neighbors of a block of complete tuples."""
+    start, stop = bounds
+    arrays = _adaptive_worker["arrays"]
+    arrays["neighbors"][start:stop] = _adaptive_worker["index"].query(arrays["complete"][start:stop], _adaptive_worker["k"])
+
+
+def _adaptive_costs_chunk(bounds: tuple):
+    """Work unit of adaptive_multi: candidate costs of a block of missing cells."""
+    start, stop = bounds
+    arrays = _adaptive_worker["arrays"]
+    phi = IIMModels(*(arrays[field][start:stop] for field in IIMModels._fields))
+    statistics = NeighborhoodStatistics(**{field: arrays["statistics_" + field] for field in NeighborhoodStatistics._fields})
+    statistics = statistics._replace(count=int(statistics.count), neighbors_per_tuple=int(statistics.neighbors_per_tuple))
+    arrays["cell_costs"][start:stop] = adaptive_cell_costs(phi, statistics, _adaptive_worker["candidate_sizes"])
+
+
+def _chunks(length: int, chunk_size: int):
+    return [(start, min(start + chunk_size, length)) for start in range(0, length, chunk_size)]
+
+
+@PROFILER.profiled("adaptive")
 def adaptive_multi(complete_tuples: np.ndarray, incomplete_tuples: np.ndarray, k: int,
                    max_learning_neighbors: int = 100,
-                   step_size: int = 4):
+                   step_size: int = 4, index: NeighborIndex = None, statistics: NeighborhoodStatistics = None,
+                   workers: int = None, chunk_size: int = 1024):
+    """Process-parallel version of adaptive, with the same parameters and the same result.
+
+    The complete tuples, the learned models and the neighborhood statistics are placed in shared memory.
+    The workers attach them once and then process chunks of complete tuples (neighbor queries)
+    and chunks of missing cells (candidate costs), so a work unit only carries its bounds.
+
+    Parameters
+    ----------
+    complete_tuples : np.ndarray
+        The complete matrix of values without missing values.
+        Should already be normalized.
+    incomplete_tuples : np.ndarray
+        The complete matrix of values with missing values in the form of NaN.
+        Should already be normalized.
+    k : int
+        The number of neighbors to use for the k nearest neighbors classifier.
+    max_learning_neighbors : int, optional
+        The maximum number of neighbors to use for the learning phase, by default 100.
+    step_size : int, optional
+        The step size for the learning phase, by default 4.
+    index : NeighborIndex, optional
+        The neighbor index fitted on complete_tuples, by default a new one.
+    statistics : NeighborhoodStatistics, optional
+        The statistics of the k nearest neighbors of the complete tuples, by default computed by the workers.
+    workers : int, optional
+        The number of worker processes, by default all cores.
+    chunk_size : int, optional
+        The number of complete tuples or missing cells in one work unit, by default 1024.
+
+    Returns
+    -------
+    phi: IIMModels
+        The learned regression parameters for all tuples in r.
+    """
     #print("Starting Algorithm 3 'adaptive'")
-    all_entries = min(int(complete_tuples.shape[0]), max_learning_neighbors)
-    phi_list = [learning(complete_tuples, incomplete_tuples, l_learning)
-                for l_learning in
-                range(1, all_entries + 1, step_size)]
-    nn = NearestNeighbors(n_neighbors=k, metric='euclidean').fit(complete_tuples)
-    number_of_models = len(phi_list) - 1
-    number_of_incomplete_tuples = len(incomplete_tuples)
+    candidate_sizes = adaptive_candidate_sizes(complete_tuples, max_learning_neighbors, step_size)
+    number_of_models = max(len(candidate_sizes) - 1, 1)
+    candidate_sizes = candidate_sizes[:number_of_models]
+    if index is None:
+        index = make_neighbor_index(complete_tuples)
+    phi = learning(complete_tuples, incomplete_tuples, candidate_sizes[-1], index)
+    workers = workers or os.cpu_count()
     #print("Finished learning; Starting main loop of Algorithm 3 'adaptive'")
 
-    # Create a pool of worker processes
-    with Pool() as p:
-        # Create an iterable of arguments to pass to the worker function
-        args = ((complete_tuple, log, complete_tuples, incomplete_tuples, nn, number_of_models, phi_list)
-                for log, complete_tuple in enumerate(complete_tuples, 1))
-        # Map the function to the pool of processes
-        costs = p.map(compute_cost_for_tuple, args)
-    costs = np.sum(costs, axis=0)
+    with SharedArrays() as shared:
+        for field, array in zip(IIMModels._fields, phi):
+            shared.put(field, array)
+        cell_costs = shared.empty("cell_costs", (len(phi.tuples), len(candidate_sizes)), np.float64)
+        statistics_shape = neighborhood_statistics(complete_tuples[:1], np.zeros((1, 1), dtype=np.intp))
+        statistics_shared = {field: shared.empty("statistics_" + field, np.shape(value), np.asarray(value).dtype)
+                             for field, value in zip(NeighborhoodStatistics._fields, statistics_shape)}
+
+        if statistics is None:
+            complete_shared = shared.put("complete", complete_tuples)
+            neighbors = shared.empty("neighbors", (len(complete_tuples), k), np.intp)
+
+        # Create a pool of worker processes
+        with Pool(workers, initializer=_attach_adaptive_worker, initargs=(shared.specs, index, k, candidate_sizes)) as p:
+            if statistics is None:
+                p.map(_adaptive_neighbors_chunk, _chunks(len(complete_tuples), chunk_size))
+                statistics = neighborhood_statistics(complete_shared, neighbors)
+                del complete_shared, neighbors
+            for field, value in zip(NeighborhoodStatistics._fields, statistics):
+                statistics_shared[field][...] = value
+
+            p.map(_adaptive_costs_chunk, _chunks(len(phi.tuples), chunk_size))
+
+        costs = np.zeros((len(incomplete_tuples), len(candidate_sizes)))
+        np.add.at(costs, phi.tuples, cell_costs)
+        del cell_costs, statistics_shared
 
     best_models_indices = np.argmin(costs, axis=1)
-    learning_neighbors = [range(1, all_entries + 1, step_size)[best_models_index]
-                          for best_models_index in best_models_indices]
+    learning_neighbors = candidate_sizes[best_models_indices]
     #print("Determined following learning neighbors for each tuple with missing attributes: {}".format(learning_neighbors))
-    phi = [phi_list[best_models_indices[i]][i] for i in range(number_of_incomplete_tuples)]
-    return phi
+    return select_models(phi, learning_neighbors)
+
+
+class StreamingIIM:
+    """Stateful IIM (non-adaptive) for rows that arrive in batches.
+
+    Complete rows are inserted into the state, incomplete rows are imputed against the complete rows inserted so far,
+    with the learning and imputation of iim_recovery. The complete rows are kept in levels of a logarithmic method:
+    new rows go to a small buffer searched by brute force, a full buffer becomes a new level with its own neighbor
+    index, and levels of similar size are merged into one. Each index is built once per doubling of the rows it
+    covers, and a query visits O(log(rows)) levels, whose candidates are re-ranked by their exact distance.
+    The cost of a batch therefore grows with the batch size and only logarithmically with the history, as long as the
+    backend answers in sublinear time (the default tree backend). The first query of a missing pattern builds the
+    structure of that pattern in every level once; streams with more than SUBSPACE_CACHE_SIZE recurring patterns
+    rebuild them and pay a cost linear in the history again.
 
+    Parameters
+    ----------
+    learning_neighbors : int, optional
+        The number of learning neighbors, by default 10.
+    neighbor_index : str, optional
+        The backend of the level indexes, see make_neighbor_index, by default "tree".
+    buffer_rows : int, optional
+        The number of complete rows searched by brute force before they are indexed, by default STREAM_BUFFER_ROWS.
+    dtype : np.dtype, optional
+        The precision of the state and of the computation, by default float64. Imputed rows are returned as float64.
+    """
 
-def compute_distances(candidate_suggestions: np.ndarray):
-    """ Calculate the sum of distances to all other candidates (Manhattan) for each candidate
+    def __init__(self, learning_neighbors: int = 10, neighbor_index: str = "tree", buffer_rows: int = None,
+                 dtype=np.float64):
+        self.learning_neighbors = learning_neighbors
+        self.neighbor_index = neighbor_index
+        self.buffer_rows = STREAM_BUFFER_ROWS if buffer_rows is None else buffer_rows
+        self.dtype = np.dtype(dtype)
+        self._rows = np.empty((0, 0), dtype=self.dtype)  # all complete rows, with spare capacity at the end
+        self._size = 0
+        self._levels = []  # (start, stop, index) over consecutive ranges of _rows, largest first; the buffer follows
+
+    @property
+    def complete_tuples(self):
+        """The complete rows inserted so far."""
+        return self._rows[:self._size]
+
+    def insert(self, rows: np.ndarray):
+        """Inserts complete rows into the state.
+
+        Parameters
+        ----------
+        rows : np.ndarray
+            The complete rows, shape (rows, attributes).
+        """
+        rows = np.atleast_2d(np.asarray(rows, dtype=self.dtype))
+        if np.isnan(rows).any():
+            raise ValueError("Only complete rows can be inserted, impute incomplete rows with impute or append")
+        if len(rows) == 0:
+            return
+        if self._size == 0:
+            self._rows = np.empty((max(len(rows), self.buffer_rows), rows.shape[1]), dtype=self.dtype)
+        elif rows.shape[1] != self._rows.shape[1]:
+            raise ValueError("Expected {} attributes, got {}".format(self._rows.shape[1], rows.shape[1]))
+
+        if self._size + len(rows) > len(self._rows):  # amortized growth
+            grown = np.empty((max(2 * len(self._rows), self._size + len(rows)), self._rows.shape[1]), dtype=self.dtype)
+            grown[:self._size] = self._rows[:self._size]
+            self._rows = grown
+        self._rows[self._size:self._size + len(rows)] = rows
+        self._size += len(rows)
+
+        buffer_start = self._levels[-1][1] if self._levels else 0
+        if self._size - buffer_start >= self.buffer_rows:
+            self._add_level(buffer_start)
+
+    def impute(self, rows: np.ndarray):
+        """Imputes incomplete rows against the current state, without inserting them.
+
+        Parameters
+        ----------
+        rows : np.ndarray
+            The rows, with missing values as NaN, shape (rows, attributes).
+
+        Returns
+        -------
+        np.ndarray
+            A float64 copy of the rows with the missing values imputed.
+        """
+        result = np.array(rows, dtype=np.float64, ndmin=2)
+        tuples_with_nan = np.isnan(result).any(axis=1)
+        if not np.any(tuples_with_nan):
+            return result
+        if self._size == 0:
+            print("No complete tuples found, unable to proceed, replacing missing values with zeroes", file=sys.stderr)
+            result[np.isnan(result)] = 0.0
+            return result
+
+        incomplete_tuples_indices = np.flatnonzero(tuples_with_nan)
+        incomplete_tuples = result[incomplete_tuples_indices].astype(self.dtype)
+        neighbors = self._neighbors(incomplete_tuples, min(self.learning_neighbors, self._size))
+        lr_models = learn_from_neighbors(self.complete_tuples, incomplete_tuples, neighbors)
+        result[incomplete_tuples_indices[lr_models.tuples], lr_models.attributes] = imputation(incomplete_tuples, lr_models)
+        return result
+
+    def append(self, rows: np.ndarray):
+        """Processes a batch: its complete rows are inserted, then its incomplete rows are imputed.
+
+        Parameters
+        ----------
+        rows : np.ndarray
+            The batch, with missing values as NaN, shape (rows, attributes).
+
+        Returns
+        -------
+        np.ndarray
+            A float64 copy of the batch with the missing values imputed.
+        """
+        rows = np.array(rows, dtype=np.float64, ndmin=2)
+        complete = ~np.isnan(rows).any(axis=1)
+        self.insert(rows[complete])
+        return self.impute(rows)
+
+    def _add_level(self, start: int):
+        """Indexes the rows from start on as a new level, merged with the previous levels that are not larger."""
+        while self._levels and self._levels[-1][1] - self._levels[-1][0] <= self._size - start:
+            start = self._levels.pop()[0]
+        self._levels.append((start, self._size, make_neighbor_index(self._rows[start:self._size], self.neighbor_index)))
+
+    def _neighbors(self, incomplete_tuples: np.ndarray, k: int):
+        """The k nearest complete rows of every incomplete tuple, over all levels and the buffer."""
+        candidates = []
+        for start, stop, index in self._levels:
+            candidates.append(start + index.query_incomplete(incomplete_tuples, min(k, stop - start)))
+        buffer_start = self._levels[-1][1] if self._levels else 0
+        if self._size > buffer_start:
+            buffer = BruteNeighborIndex(self._rows[buffer_start:self._size])
+            candidates.append(buffer_start + buffer.query_incomplete(incomplete_tuples, min(k, self._size - buffer_start)))
+        candidates = np.concatenate(candidates, axis=1)
+        if len(candidates[0]) == k:
+            return candidates
+
+        # re-rank the candidates of all levels by their distance on the observed attributes
+        observed = ~np.isnan(incomplete_tuples)
+        observed[~observed.any(axis=1)] = True
+        differences = self._rows[candidates] - np.nan_to_num(incomplete_tuples)[:, None, :]
+        distances = np.einsum('qcd,qcd->qc', differences, differences * observed[:, None, :])
+        return np.take_along_axis(candidates, smallest_indices(distances, k), axis=1)
+
+
+@PROFILER.profiled("compute_distances")
+def compute_distances(candidate_suggestions: np.ndarray, valid: np.ndarray = None):
+    """ Calculate the sum of distances to all other candidates (Manhattan) for each candidate,
+    for a whole batch of missing cells at once
 
     Parameters
     ----------
     candidate_suggestions : np.ndarray
-        All other candidates to compare the values to.
+        The candidates of every missing cell, shape (cells, l). A 1D array is treated as a single cell.
+    valid : np.ndarray, optional
+        Boolean mask of the candidates to take into account, shape (cells, l), by default all of them.
 
     Returns
     -------
-    distances
-        The sum of distances to all other candidates.
+    distances : np.ndarray
+        The sum of distances to all other valid candidates of the same cell, shape (cells, l).
+        Invalid candidates have a distance of 0.
     """
-    distances = []
-    for i in range(len(candidate_suggestions)):
-        temp_distances = np.abs(candidate_suggestions[i] - np.delete(candidate_suggestions, i))
-        distances.append(np.sum(temp_distances))
+    candidate_suggestions = np.atleast_2d(candidate_suggestions)
+    if valid is None:
+        valid = np.ones(candidate_suggestions.shape, dtype=bool)
+    else:
+        valid = np.atleast_2d(valid)
+
+    number_of_cells, number_of_candidates = candidate_suggestions.shape
+    distances = np.zeros(candidate_suggestions.shape, dtype=candidate_suggestions.dtype)
+
+    # the pairwise differences are materialized, so process the cells in blocks of bounded size
+    block = max(1, CANDIDATE_BLOCK_ELEMENTS // max(number_of_candidates * number_of_candidates, 1))
+    for start in range(0, number_of_cells, block):
+        candidates = candidate_suggestions[start:start + block]
+        mask = valid[start:start + block]
+        pairwise = np.abs(candidates[:, :, None] - candidates[:, None, :])
+        distances[start:start + block] = np.where(mask[:, None, :], pairwise, 0.0).sum(axis=2)
+
+    distances[~valid] = 0.0
     return distances
 
 
-def compute_weights(distances: List[float]):
+def compute_weights(distances: np.ndarray, valid: np.ndarray = None):
     """ A candidate's weight is determined by normalizing by all other candidates' distances.
-    All weights together sum up to 1.
+    All weights of a cell together sum up to 1.
+    Candidates at distance zero get no weight, unless all candidates of the cell are at distance zero,
+    in which case every valid candidate gets the same weight.
 
     Parameters
     ----------
-    distances : list[float]
-        A list of all distances.
+    distances : np.ndarray
+        The distances of every missing cell, shape (cells, l). A 1D array is treated as a single cell.
+    valid : np.ndarray, optional
+        Boolean mask of the candidates to take into account, shape (cells, l), by default all of them.
 
     Returns
     -------
-    weight
-        The weight of the candidate.
+    weights : np.ndarray
+        The weights of the candidates, shape (cells, l).
     """
+    distances = np.atleast_2d(distances)
+    if valid is None:
+        valid = np.ones(distances.shape, dtype=bool)
+    else:
+        valid = np.atleast_2d(valid)
 
-    distances = np.array(distances)
-    weights = np.zeros(distances.shape)
+    inverse_distances = np.zeros(distances.shape, dtype=distances.dtype)
+    nonzero_indices = (distances != 0) & valid
+    inverse_distances[nonzero_indices] = 1 / distances[nonzero_indices]
 
-    nonzero_indices = distances != 0
-    weights[nonzero_indices] = 1 / distances[nonzero_indices] / np.sum(1 / distances[nonzero_indices])
+    totals = np.sum(inverse_distances, axis=1, keepdims=True)
+    weights = np.divide(inverse_distances, totals, out=np.zeros_like(inverse_distances), where=totals != 0)
 
     # Handle the case where all distances are zero
-    if np.sum(weights) == 0:
-        weights = np.ones(distances.shape) / len(distances)
+    all_zero = np.sum(weights, axis=1) == 0
+    if np.any(all_zero):
+        weights[all_zero] = valid[all_zero] / np.sum(valid[all_zero], axis=1, keepdims=True)
 
     return weights
 
 
+def candidate_weights(candidate_suggestions: np.ndarray, valid: np.ndarray = None):
+    """ Weighting kernel of the imputation: distances and normalized weights of the candidates of all missing cells.
+
+    Parameters
+    ----------
+    candidate_suggestions : np.ndarray
+        The candidates of every missing cell, shape (cells, l).
+    valid : np.ndarray, optional
+        Boolean mask of the candidates to take into account, shape (cells, l), by default all of them.
+
+    Returns
+    -------
+    distances : np.ndarray
+        The sum of Manhattan distances of each candidate to the other candidates of its cell, shape (cells, l).
+    weights : np.ndarray
+        The normalized weights of the candidates, shape (cells, l).
+    """
+    distances = compute_distances(candidate_suggestions, valid)
+    return distances, compute_weights(distances, valid)
+
+
 def count_nans(list_of_arrays: List[np.ndarray]):
     """ Counts the number of NaNs in a list of arrays.
 
@@ -402,6 +1332,61 @@ def count_nans(list_of_arrays: List[np.ndarray]):
     return sum(np.isnan(arr).sum() for arr in list_of_arrays)
 
 
+def parse_iim_parameters(parameters: str):
+    """
+    Parses the parameters of the IIM algorithm code, e.g. "5" or "5ap4".
+
+    The parameters start with the number of neighbors, followed by single-letter flags with an optional number:
+    - a: use the adaptive version of the algorithm
+    - p[N]: evaluate the adaptive version in N worker processes (all cores if N is omitted)
+    - b, t, x: search neighbors by brute force, with trees or approximately (see make_neighbor_index)
+    - c[N]: recover the incomplete tuples in blocks of N rows (DEFAULT_CHUNK_ROWS if N is omitted)
+    - f: compute in float32 instead of float64 (see iim_recovery)
+    - h[N]: keep the neighbor searches in the cache of the process, up to N MiB (see NeighborhoodCache)
+    - i: report the per-phase instrumentation of PROFILER; returned as "instrument", which is not passed to iim_recovery
+
+    Parameters
+    ----------
+    parameters : str
+        The parameters part of the algorithm code.
+
+    Returns
+    -------
+    dict
+        The keyword arguments for iim_recovery.
+    """
+    match = re.fullmatch(r"(\d*)((?:[a-z]\d*)*)", parameters.strip().lower())
+    if match is None:
+        raise ValueError("Malformed IIM parameters: " + parameters)
+
+    neighbors, flags = match.groups()
+    flags = {flag: int(value) if value else None for flag, value in re.findall(r"([a-z])(\d*)", flags)}
+
+    unknown = set(flags) - {"a", "p", "c", "f", "h", "i"} - set(NEIGHBOR_INDEX_FLAGS)
+    if unknown:
+        raise ValueError("Unknown IIM flags: " + ", ".join(sorted(unknown)))
+    backends = [NEIGHBOR_INDEX_FLAGS[flag] for flag in flags if flag in NEIGHBOR_INDEX_FLAGS]
+    if len(backends) > 1:
+        raise ValueError("More than one neighbor index flag in IIM parameters: " + parameters)
+
+    kwargs = {"adaptive_flag": "a" in flags}
+    if neighbors:
+        kwargs["learning_neighbors"] = int(neighbors)
+    if "p" in flags:
+        kwargs["workers"] = flags["p"]  # None = all cores
+    if backends:
+        kwargs["neighbor_index"] = backends[0]
+    if "c" in flags:
+        kwargs["chunk_rows"] = flags["c"] or DEFAULT_CHUNK_ROWS
+    if "f" in flags:
+        kwargs["dtype"] = np.float32
+    if "h" in flags:
+        kwargs["cache"] = shared_neighborhood_cache(flags["h"])
+    if "i" in flags:
+        kwargs["instrument"] = True
+    return kwargs
+
+
 def impute_with_algorithm(alg_code: str, matrix: np.ndarray):
     """
     Imputes the input matrix with a specified algorithm.
@@ -410,7 +1395,7 @@ def impute_with_algorithm(alg_code: str, matrix: np.ndarray):
     ----------
     alg_code : str
         The algorithm and its parameters.
-        The first parameter is the name, the second the number of neighbors and the third whether to use adaptive or not.
+        The first parameter is the name, the second the number of neighbors followed by the flags (see parse_iim_parameters).
     matrix : np.ndarray
         The input matrix to be imputed.
 
@@ -423,14 +1408,9 @@ def impute_with_algorithm(alg_code: str, matrix: np.ndarray):
     # Imputation
     alg_code = alg_code.split()
 
-    if len(alg_code) > 1:
-        match = re.match(r"(\d+)([a-zA-Z]+)", alg_code[1], re.I)
-        if match:
-            neighbors, adaptive_flag = match.groups()
-            matrix_imputed = iim_recovery(matrix, adaptive_flag=adaptive_flag.startswith("a"),
-                                          learning_neighbors=int(neighbors))
-        else:
-            matrix_imputed = iim_recovery(matrix, adaptive_flag=False, learning_neighbors=int(alg_code[1]))
+    parameters = parse_iim_parameters(alg_code[1] if len(alg_code) > 1 else "")
+    parameters.pop("instrument", None)  # handled by the caller, see impute_piped_data
+    matrix_imputed = iim_recovery(matrix, **parameters)
 
     # verification to check for NaN. If found, assign absurdly high value to them.
     nan_mask = np.isnan(matrix_imputed)
@@ -438,7 +1418,72 @@ def impute_with_algorithm(alg_code: str, matrix: np.ndarray):
 
     return matrix_imputed
 
-def impute_piped_data(alg_code: str):
+def read_matrix_frame(stream):
+    """Reads one binary matrix frame: a FRAME_HEADER (rows, columns, dtype) followed by the values in row-major order.
+
+    Parameters
+    ----------
+    stream : BinaryIO
+        The binary stream to read from, e.g. sys.stdin.buffer.
+
+    Returns
+    -------
+    np.ndarray or None
+        The matrix as float64, or None if the stream ended before the frame.
+    """
+    header = _read_exact(stream, FRAME_HEADER.size)
+    if header is None:
+        return None
+    rows, columns, dtype = FRAME_HEADER.unpack(header)
+    dtype = np.dtype(dtype.rstrip(b" \0").decode("ascii"))
+    data = _read_exact(stream, rows * columns * dtype.itemsize)
+    if data is None:
+        raise EOFError("Matrix frame ended after its header")
+    return np.frombuffer(data, dtype=dtype).reshape(rows, columns).astype(np.float64)
+
+
+def write_matrix_frame(stream, matrix: np.ndarray):
+    """Writes a matrix as one binary frame of little-endian float64 values, see read_matrix_frame."""
+    matrix = np.ascontiguousarray(matrix, dtype=FRAME_DTYPE)
+    stream.write(FRAME_HEADER.pack(matrix.shape[0], matrix.shape[1], FRAME_DTYPE.encode("ascii")))
+    stream.write(matrix.tobytes())
+
+
+def is_instrumented(alg_code: str):
+    """Whether the algorithm code asks for the per-phase instrumentation (flag i, see parse_iim_parameters)."""
+    alg_code = alg_code.split()
+    try:
+        return parse_iim_parameters(alg_code[1] if len(alg_code) > 1 else "").get("instrument", False)
+    except ValueError:
+        return False  # reported by impute_with_algorithm
+
+
+def instrumentation_line(runtime: float, phases: dict):
+    """The instrumentation of one imputation as a single line of JSON: {"runtime_us": ..., "phases": {...}}."""
+    return json.dumps({"runtime_us": runtime, "phases": phases}, separators=(",", ":"))
+
+
+def write_instrumentation(stream, line: str):
+    """Writes the instrumentation line of a binary response as int32 byte length and UTF-8 text, length 0 if none."""
+    data = line.encode("utf-8")
+    stream.write(struct.pack("<i", len(data)))
+    stream.write(data)
+
+
+def _read_exact(stream, size: int):
+    """Reads exactly size bytes, None if the stream is at its end, EOFError if it ends in between."""
+    data = bytearray()
+    while len(data) < size:
+        chunk = stream.read(size - len(data))
+        if not chunk:
+            if not data:
+                return None
+            raise EOFError("Stream ended in the middle of a matrix frame")
+        data += chunk
+    return bytes(data)
+
+
+def impute_piped_data(alg_code: str, binary: bool = False):
     """Executes the imputation algorithm for a matrix given by stdit and returns the imputation into stdout.
 
     Parameters
@@ -446,6 +1491,11 @@ def impute_piped_data(alg_code: str):
     alg_code : str
         The algorithm and its parameters.
         The first parameter is the name, the second the number of neighbors and the third whether to use adaptive or not.
+    binary : bool, optional
+        Whether the matrices are exchanged as binary frames (see read_matrix_frame) instead of text, by default False.
+        The runtime is then written as one little-endian float64 before the output frame,
+        and the instrumentation line (see write_instrumentation) after it.
+        In text mode, the instrumentation line is printed to stderr.
 
     Returns
     -------
@@ -453,15 +1503,22 @@ def impute_piped_data(alg_code: str):
         The imputed matrix.
     """
     
-    input_mat = [];
-    
-    for line in sys.stdin:
-        pline = np.fromstring(line, sep=' ');
-        input_mat.append(pline);
-    #end for
-    
-    # read input matrix
-    matrix = np.array(input_mat);
+    if is_instrumented(alg_code):
+        PROFILER.start()
+
+    with PROFILER.phase("parsing"):
+        if binary:
+            matrix = read_matrix_frame(sys.stdin.buffer)
+        else:
+            input_mat = [];
+
+            for line in sys.stdin:
+                pline = np.fromstring(line, sep=' ');
+                input_mat.append(pline);
+            #end for
+
+            # read input matrix
+            matrix = np.array(input_mat);
     
     # beginning of imputation process - start time measurement
     start_time = time.time()
@@ -471,10 +1528,74 @@ def impute_piped_data(alg_code: str):
 
     exec_time = (end_time - start_time) * 1000 * 1000
     
+    if binary:
+        sys.stdout.buffer.write(struct.pack("<d", exec_time))
+        with PROFILER.phase("serialization"):
+            write_matrix_frame(sys.stdout.buffer, matrix_imputed)
+        instrumented = PROFILER.enabled
+        phases = PROFILER.stop()
+        write_instrumentation(sys.stdout.buffer, instrumentation_line(exec_time, phases) if instrumented else "")
+        sys.stdout.buffer.flush()
+        return;
+
     print(exec_time)
     
-    for i in range(0, len(matrix_imputed)):
-        print(' '.join(map(str, matrix_imputed[i])));
+    with PROFILER.phase("serialization"):
+        for i in range(0, len(matrix_imputed)):
+            print(' '.join(map(str, matrix_imputed[i])));
     
+    if PROFILER.enabled:
+        print(instrumentation_line(exec_time, PROFILER.stop()), file=sys.stderr)
     return;
 
+
+def serve_piped_requests():
+    """Imputes any number of matrices over one stdin/stdout pair, until stdin is closed.
+
+    Every request is the algorithm code (int32 byte length and UTF-8 text, see impute_with_algorithm)
+    followed by the matrix as a binary frame (see read_matrix_frame). Every response is the runtime of the imputation
+    alone (float64, microseconds), the imputed matrix as a binary frame and the instrumentation line
+    (see write_instrumentation, empty unless the algorithm code has the flag i). A failed request is answered
+    with a NaN runtime and an empty 0x0 frame, the error is printed to stderr and the server goes on.
+    """
+    stdin, stdout = sys.stdin.buffer, sys.stdout.buffer
+    while True:
+        length = _read_exact(stdin, 4)
+        if length is None:
+            return
+        alg_code = _read_exact(stdin, struct.unpack("<i", length)[0]).decode("utf-8")
+        instrumented = is_instrumented(alg_code)
+        if instrumented:
+            PROFILER.start()
+        with PROFILER.phase("parsing"):
+            matrix = read_matrix_frame(stdin)
+
+        try:
+            start_time = time.time()
+            matrix_imputed = impute_with_algorithm(alg_code, matrix)
+            exec_time = (time.time() - start_time) * 1000 * 1000
+        except Exception:
+            traceback.print_exc(file=sys.stderr)
+            exec_time, matrix_imputed = float("nan"), np.empty((0, 0))
+
+        stdout.write(struct.pack("<d", exec_time))
+        with PROFILER.phase("serialization"):
+            write_matrix_frame(stdout, matrix_imputed)
+        phases = PROFILER.stop()
+        write_instrumentation(stdout, instrumentation_line(exec_time, phases) if instrumented else "")
+        stdout.flush()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Imputes the matrix given by stdin, see impute_piped_data.")
+    parser.add_argument("alg_code", nargs="?", help='the algorithm and its parameters, e.g. "iim 5ap4"')
+    parser.add_argument("--binary", action="store_true", help="exchange the matrices as binary frames instead of text")
+    parser.add_argument("--server", action="store_true",
+                        help="keep running and impute framed requests until stdin is closed, see serve_piped_requests")
+    arguments = parser.parse_args()
+    if arguments.server:
+        serve_piped_requests()
+    elif arguments.alg_code is None:
+        parser.error("the algorithm code is required unless running as --server")
+    else:
+        impute_piped_data(arguments.alg_code, binary=arguments.binary)
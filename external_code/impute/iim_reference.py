@@ -0,0 +1,109 @@
+"""Frozen reference implementation of IIM for the benchmark harness (see benchmark_iim.py).
+
+It follows the algorithm one tuple, one missing cell and one neighbor at a time, with a scikit-learn Ridge estimator
+per neighbor, and is kept deliberately free of the optimizations of iim.py. Its semantics are those of iim.py:
+- the learning neighbors of an incomplete tuple are searched on its observed attributes only
+  (a tuple without observed attribute uses the distance to the origin over all attributes)
+- the adaptive version evaluates the candidate numbers of learning neighbors 1, 1 + step_size, ...
+  up to min(complete tuples, 10), without the largest one, with the cost of iim.adaptive.
+Do not optimize this file, its purpose is to stay obviously correct.
+"""
+
+import numpy as np
+from sklearn.linear_model import Ridge
+
+
+def reference_recovery(matrix_nan: np.ndarray, adaptive_flag: bool = False, learning_neighbors: int = 10,
+                       step_size: int = 4):
+    """Reference counterpart of iim.iim_recovery, with the same parameters and the same result.
+
+    Parameters
+    ----------
+    matrix_nan : np.ndarray
+        The complete matrix of values with missing values in the form of NaN. It is not modified.
+    adaptive_flag : bool, optional
+        Whether to use the adaptive version of the algorithm, by default False.
+    learning_neighbors : int, optional
+        The number of neighbors of the learning phase, or of the adaptive cost, by default 10.
+    step_size : int, optional
+        The step size between two candidate numbers of learning neighbors of the adaptive version, by default 4.
+
+    Returns
+    -------
+    np.ndarray
+        A copy of the matrix with the missing values imputed.
+    """
+    matrix = matrix_nan.copy()
+    tuples_with_nan = np.isnan(matrix).any(axis=1)
+    complete_tuples = matrix[~tuples_with_nan]
+    if not np.any(tuples_with_nan):
+        return matrix
+    if len(complete_tuples) == 0:
+        matrix[np.isnan(matrix)] = 0.0
+        return matrix
+    learning_neighbors = min(learning_neighbors, len(complete_tuples))
+
+    if adaptive_flag:
+        all_entries = min(len(complete_tuples), 10)
+        candidate_sizes = list(range(1, all_entries + 1, step_size))
+        candidate_sizes = candidate_sizes[:max(len(candidate_sizes) - 1, 1)]
+        complete_neighbors = [nearest(complete_tuples, tuple_, np.ones(len(tuple_), dtype=bool), learning_neighbors)
+                              for tuple_ in complete_tuples]
+
+    for row in np.flatnonzero(tuples_with_nan):
+        incomplete_tuple = matrix_nan[row]
+        missing = np.isnan(incomplete_tuple)
+        observed = ~missing if np.any(~missing) else np.ones(len(incomplete_tuple), dtype=bool)
+        query = np.nan_to_num(incomplete_tuple)
+
+        if adaptive_flag:
+            neighbors = nearest(complete_tuples, query, observed, candidate_sizes[-1])
+            costs = [sum(cell_cost(complete_tuples, complete_neighbors, neighbors[:l], attribute)
+                         for attribute in np.flatnonzero(missing))
+                     for l in candidate_sizes]
+            l = candidate_sizes[int(np.argmin(costs))]
+        else:
+            l = learning_neighbors
+        neighbors = nearest(complete_tuples, query, observed, l)
+
+        for attribute in np.flatnonzero(missing):
+            others = np.arange(len(incomplete_tuple)) != attribute
+            candidates = np.array([model.predict(query[others][None, :])[0]
+                                   for model in fit_models(complete_tuples, neighbors, attribute)])
+            matrix[row, attribute] = np.dot(candidates, weights(candidates))
+    return matrix
+
+
+def nearest(complete_tuples: np.ndarray, query: np.ndarray, observed: np.ndarray, l: int):
+    """Indices of the l nearest complete tuples of the query (Euclidean over the observed attributes), nearest first."""
+    distances = np.sqrt(np.sum((complete_tuples[:, observed] - query[observed]) ** 2, axis=1))
+    return np.argsort(distances, kind='stable')[:l]
+
+
+def fit_models(complete_tuples: np.ndarray, neighbors: np.ndarray, attribute: int):
+    """One Ridge model per neighbor, predicting the attribute from all other attributes of that neighbor alone."""
+    others = np.arange(complete_tuples.shape[1]) != attribute
+    return [Ridge().fit(complete_tuples[[neighbor]][:, others], complete_tuples[[neighbor], attribute])
+            for neighbor in neighbors]
+
+
+def cell_cost(complete_tuples: np.ndarray, complete_neighbors: list, neighbors: np.ndarray, attribute: int):
+    """Adaptive cost of the models of one missing cell: the squared error of every model on every
+    (complete tuple, one of its neighbors) pair, summed and divided by the number of neighbors per tuple."""
+    others = np.arange(complete_tuples.shape[1]) != attribute
+    cost = 0.0
+    for model in fit_models(complete_tuples, neighbors, attribute):
+        for complete_tuple, its_neighbors in zip(complete_tuples, complete_neighbors):
+            predictions = model.predict(complete_tuples[its_neighbors][:, others])
+            cost += np.sum((complete_tuple[attribute] - predictions) ** 2) / len(its_neighbors)
+    return cost
+
+
+def weights(candidates: np.ndarray):
+    """Weights of the candidates of one cell: normalized inverse sums of Manhattan distances to the other candidates.
+    Candidates at distance zero get no weight, unless all of them are at distance zero, then they are weighted equally."""
+    distances = np.array([np.sum(np.abs(candidate - candidates)) for candidate in candidates])
+    inverse = np.array([1 / distance if distance != 0 else 0.0 for distance in distances])
+    if np.sum(inverse) == 0:
+        return np.full(len(candidates), 1 / len(candidates))
+    return inverse / np.sum(inverse)
@@ -1,216 +1,391 @@
 #!/usr/bin/python3
 
+import os;
+import timings;
+timings.reset();
 import sys;
+from threadbudget import apply_thread_budget;
+parallel_threads = apply_thread_budget(1); # before numpy, so the BLAS/OpenMP pools pick up the budget
+from resultcache import open_result_cache;
+cache = open_result_cache();
+from timebudget import apply_time_budget, keras_time_limit, budget_report;
+time_limit = apply_time_budget(); # minutes of training, None for unbounded
+import json;
+import time;
 import warnings;
+import traceback;
 import numpy as np;
 import sktime as skt;
 import pandas as pd;
 warnings.simplefilter(action='ignore', category=FutureWarning);
 warnings.simplefilter(action='ignore', category=pd.errors.PerformanceWarning);
 
-from sktime.datasets import load_from_tsfile_to_dataframe;
+from tsfile import load_ts, to_nested;
 
 #
 # cli input
 #
 if len(sys.argv) < 3:
-    print("Insufficient number of CLI arguments. Usage: `python3 classify.py classif_algo slot`");
+    print("Insufficient number of CLI arguments. Usage: `python3 classify.py classif_algo[,classif_algo...]|manifest.json slot`");
     exit(-1);
 #endif
 
-classifier_string = sys.argv[1];
+# one classifier prints its predictions; a list (comma-separated or a JSON manifest {"classifiers": [...], "output": dir})
+# runs all of them on the data loaded once and writes per classifier <output>/<classif_algo>.txt and .runtime
+if sys.argv[1].endswith(".json"):
+    with open(sys.argv[1]) as manifest_file:
+        manifest = json.load(manifest_file);
+    #end with
+    classifier_strings = manifest["classifiers"];
+    output_dir = manifest.get("output", "data/batch_" + sys.argv[2] + "/");
+    batch = True;
+else:
+    classifier_strings = sys.argv[1].split(",");
+    output_dir = "data/batch_" + sys.argv[2] + "/";
+    batch = len(classifier_strings) > 1;
+#endif
 
 #
 # prepare classification
 #
 
-X_train, y_train = load_from_tsfile_to_dataframe('data/dataset_TRAIN_' + sys.argv[2] + '.ts');
-X_test,  y_test  = load_from_tsfile_to_dataframe('data/dataset_TEST_'  + sys.argv[2] + '.ts');
+train_file = 'data/dataset_TRAIN_' + sys.argv[2] + '.ts';
+test_file  = 'data/dataset_TEST_'  + sys.argv[2] + '.ts';
+
+timings.lap("import");
+
+# 3D numpy (instances x channels x length) is accepted by all sktime classifiers, the nested frame is built only
+# for those whose inner type is nested and the formats the numpy reader does not support
+nested_classifiers = ["proxforest", "proxtree", "proxstump", "tsfresh", "tsfresh-all"];
+
+# classifiers with a time_limit_in_minutes contract, the keras models (lstm-fcn, cnn) stop early instead;
+# a contract alone makes sktime train until the time runs out (up to contract_max_*, unbounded by default),
+# so the contract_max_* are set to the default ensemble sizes and the budget only caps the unbounded model
+contracted_classifiers = ["tde", "cboss", "stc", "hivecote2", "arsenal"];
 
-parallel_threads = 1; # todo: replace with sys.argv[2] and set one above to static
+def contract(**caps):
+    return {} if time_limit is None else dict(time_limit_in_minutes=time_limit, **caps);
+#end function
+
+def stc_estimator():
+    # the rotation forest of stc gets the contract of stc and would grow to 500 trees under it
+    from sktime.classification.sklearn import RotationForest;
+    return RotationForest(n_estimators=200, contract_max_n_estimators=200);
+#end function
+
+# loaded for the first classifier that is not in the result cache, shared by the classifiers of a batch;
+# shared_load_seconds sums the time of these shared loads, a batch excludes it from the runtime of the classifiers
+X_train = None;
+nested_data = None;
+shared_load_seconds = 0.0;
+
+def load_data():
+    global X_train, y_train, X_test, y_test;
+    try:
+        [X_train, y_train] = load_ts(train_file);
+        [X_test,  y_test]  = load_ts(test_file);
+    except ValueError:
+        from sktime.datasets import load_from_tsfile_to_dataframe;
+        X_train, y_train = load_from_tsfile_to_dataframe(train_file);
+        X_test,  y_test  = load_from_tsfile_to_dataframe(test_file);
+    #end try
+    timings.lap("load");
+#end function
 
 def make_boring(X_train, X_test, y_train):
-    # Step 1: transform test set from string/object to int and store a dictionary
-    myDict = {}
-    newTrain = [];
-    for i in range(0, len(y_train)):
-        classVal = y_train[i];
-        keys = [k for k, v in myDict.items() if v == classVal];
-        if len(keys) == 0:
-            keyVal = len(myDict);
-            myDict[keyVal] = y_train[i];
-        else:
-            keyVal = keys[0];
-        #endif
-        newTrain.append(keyVal);
-    #end for
-    y_train = np.array(newTrain);
+    # Step 1: transform train labels from string/object to int, numbered in order of first appearance,
+    # and keep the labels to revert the predictions (classes[code])
+    classes, first, codes = np.unique(y_train, return_index=True, return_inverse=True);
+    order = np.argsort(first, kind='stable');
+    rank = np.empty(len(order), dtype=np.int64);
+    rank[order] = np.arange(len(order));
+    y_train = rank[codes.reshape(-1)];
+    classes = classes[order];
+    
+    # Step 2: transform train & test sets to boring 2D arrays, the channels of a series are concatenated;
+    # a contiguous 3D array is only reshaped (no copy), the nested frame of the fallback loader is stacked once
+    [X_train, X_test] = [X if isinstance(X, np.ndarray) else np.array([[cell.to_numpy() for cell in row] for row in X.to_numpy()])
+                         for X in [X_train, X_test]];
+    
+    X_train = X_train.reshape(len(X_train), -1);
+    X_test = X_test.reshape(len(X_test), -1);
+    
+    return [X_train, X_test, y_train, classes];
+#end function
+
+def make_classifier(classifier_string):
+    # returns [classifier, boring, stopper]: boring classifiers take the 2D arrays and integer labels of make_boring,
+    # stopper is the early-stopping callback enforcing the time budget of the keras models
+    boring = False;
+    stopper = None;
+    
+        #
+        # Dictionary based
+        #
+    if classifier_string == "muse":
+        from sktime.classification.dictionary_based import MUSE;
+        classifier = MUSE(n_jobs=parallel_threads, random_state=182322303);
+    
+    elif classifier_string == "weasel": #UNIVAR
+        from sktime.classification.dictionary_based import WEASEL;
+        classifier = WEASEL(n_jobs=parallel_threads, random_state=182322303);
+    
+    elif classifier_string == "itde":
+        from sktime.classification.dictionary_based import IndividualTDE;
+        classifier = IndividualTDE(n_jobs=parallel_threads, random_state=182322303);
+    
+    elif classifier_string == "tde":
+        from sktime.classification.dictionary_based import TemporalDictionaryEnsemble;
+        classifier = TemporalDictionaryEnsemble(n_jobs=parallel_threads, random_state=182322303,
+                                                **contract(contract_max_n_parameter_samples=250));
+    
+    elif classifier_string == "cboss":
+        from sktime.classification.dictionary_based import ContractableBOSS;
+        classifier = ContractableBOSS(n_jobs=parallel_threads, random_state=182322303,
+                                      **contract(contract_max_n_parameter_samples=250));
+    
+        #
+        # Distance based
+        #
+    elif classifier_string == "knn":
+        from sktime.classification.distance_based import KNeighborsTimeSeriesClassifier;
+        classifier = KNeighborsTimeSeriesClassifier(n_jobs=parallel_threads); #no random_state
+    
+    elif classifier_string == "proxforest":
+        from sktime.classification.distance_based import ProximityForest;
+        classifier = ProximityForest(n_jobs=parallel_threads, random_state=182322303); # no contract, the budget is only reported
+    
+    elif classifier_string == "proxtree":
+        from sktime.classification.distance_based import ProximityTree;
+        classifier = ProximityTree(n_jobs=parallel_threads, random_state=182322303);
+    
+    elif classifier_string == "proxstump":
+        from sktime.classification.distance_based import ProximityStump;
+        classifier = ProximityStump(n_jobs=parallel_threads, random_state=182322303);
+    
+    elif classifier_string == "shapedtw":
+        from sktime.classification.distance_based import ShapeDTW;
+        classifier = ShapeDTW();#no random_state
+        # something goes wrong with the original structure
+        boring = True;
     
-    # Step 2: transform train & test sets from fancy pandas indexed table to boring list of lists
-    X_train = X_train.to_numpy();
-    X_test = X_test.to_numpy();
+        #
+        # Hybrid
+        #
+    elif classifier_string == "hivecote":
+        from sktime.classification.hybrid import HIVECOTEV1;
+        classifier = HIVECOTEV1(n_jobs=parallel_threads);
     
-    series = len(X_train);
-    seriesTest = len(X_test);
-    seriesLen = len(X_train[0][0]);
+    elif classifier_string == "hivecote2":
+        from sktime.classification.hybrid import HIVECOTEV2;
+        classifier = HIVECOTEV2(n_jobs=parallel_threads, **contract(
+            stc_params={"n_shapelet_samples": 10000, "contract_max_n_shapelet_samples": 10000, "estimator": stc_estimator()},
+            drcif_params={"n_estimators": 500, "contract_max_n_estimators": 500},
+            arsenal_params={"num_kernels": 2000, "n_estimators": 25, "contract_max_n_estimators": 25},
+            tde_params={"n_parameter_samples": 250, "max_ensemble_size": 50, "randomly_selected_params": 50,
+                        "contract_max_n_parameter_samples": 250}));
     
-    newTrain = np.array([X_train[j][0][i] for j in range(0, series) for i in range(0, seriesLen)]);
-    newTest = np.array([X_test[j][0][i] for j in range(0, seriesTest) for i in range(0, seriesLen)]);
+        #
+        # Interval based
+        #
+    elif classifier_string == "tsf":
+        from sktime.classification.interval_based import TimeSeriesForestClassifier;
+        classifier = TimeSeriesForestClassifier(n_jobs=parallel_threads, random_state=182322303);
     
-    X_train = newTrain.reshape(series, seriesLen);
-    X_test = newTest.reshape(seriesTest, seriesLen);
+    elif classifier_string == "cif":
+        from sktime.classification.interval_based import CanonicalIntervalForest;
+        classifier = CanonicalIntervalForest(n_jobs=parallel_threads, random_state=182322303);
     
-    return [X_train, X_test, y_train, myDict];
+        #
+        # Shapelet based
+        #
+    elif classifier_string == "stc":
+        from sktime.classification.shapelet_based import ShapeletTransformClassifier;
+        classifier = ShapeletTransformClassifier(n_jobs=parallel_threads, random_state=182322303,
+                                                 **contract(contract_max_n_shapelet_samples=10000, estimator=stc_estimator()));
+    
+        #
+        # NN based
+        #
+    elif classifier_string == "lstm-fcn":
+        from sktime.classification.deep_learning import LSTMFCNClassifier;
+        stopper = None if time_limit is None else keras_time_limit(time_limit);
+        classifier = LSTMFCNClassifier(n_epochs=1000, callbacks=None if stopper is None else [stopper], random_state=182322303, verbose=0);
+    
+    elif classifier_string == "cnn":
+        from sktime.classification.deep_learning.cnn import CNNClassifier;
+        stopper = None if time_limit is None else keras_time_limit(time_limit);
+        classifier = CNNClassifier(n_epochs=1000, callbacks=None if stopper is None else [stopper], random_state=182322303, verbose=False);
+    
+        #
+        # Kernel based
+        #
+    elif classifier_string == "svc":
+        from sktime.classification.kernel_based import TimeSeriesSVC;
+        classifier = TimeSeriesSVC(random_state=182322303);
+
+    elif classifier_string == "arsenal":
+        from sktime.classification.kernel_based import Arsenal;
+        classifier = Arsenal(n_jobs=parallel_threads, random_state=182322303, **contract(contract_max_n_estimators=25));
+
+    elif classifier_string == "rocket":
+        from sktime.classification.kernel_based import RocketClassifier;
+        classifier = RocketClassifier(n_jobs=parallel_threads, random_state=182322303);
+    
+        #
+        # Feature based
+        #
+    elif classifier_string == "catch22":
+        from sktime.classification.feature_based import Catch22Classifier;
+        from sklearn.ensemble import RandomForestClassifier;
+        classifier = Catch22Classifier(estimator=RandomForestClassifier(n_estimators=200), n_jobs=parallel_threads, random_state=182322303);
+    
+    elif classifier_string == "mpc":
+        from sktime.classification.feature_based import MatrixProfileClassifier;
+        classifier = MatrixProfileClassifier(n_jobs=parallel_threads, random_state=182322303);
+    
+    elif classifier_string == "signature":
+        from sktime.classification.feature_based import SignatureClassifier;
+        classifier = SignatureClassifier(random_state=182322303);
+    
+    elif classifier_string == "tsfresh":
+        from sktime.classification.feature_based import TSFreshClassifier;
+        classifier = TSFreshClassifier(n_jobs=parallel_threads, random_state=182322303);
+    
+    elif classifier_string == "tsfresh-all":
+        from sktime.classification.feature_based import TSFreshClassifier;
+        classifier = TSFreshClassifier(relevant_feature_extractor=False, n_jobs=parallel_threads, random_state=182322303);
+    
+        #
+        # External (non-sktime)
+        #
+    elif classifier_string == "xgboost":
+        import xgboost as xgb;
+        classifier = xgb.XGBClassifier(n_jobs=parallel_threads, random_state=182322303);
+        # unlike sktime, the structure expectation is very different
+        boring = True;
+    else:
+        raise ValueError("Unknown classifier: " + classifier_string);
+    #endif
+    
+    return [classifier, boring, stopper];
 #end function
 
-    #
-    # Dictionary based
-    #
-if classifier_string == "muse":
-    from sktime.classification.dictionary_based import MUSE;
-    classifier = MUSE(random_state=182322303);
-    
-elif classifier_string == "weasel": #UNIVAR
-    from sktime.classification.dictionary_based import WEASEL;
-    classifier = WEASEL(n_jobs=parallel_threads, random_state=182322303);
-    
-elif classifier_string == "itde":
-    from sktime.classification.dictionary_based import IndividualTDE;
-    classifier = IndividualTDE(random_state=182322303);
-    
-elif classifier_string == "tde":
-    from sktime.classification.dictionary_based import TemporalDictionaryEnsemble;
-    classifier = TemporalDictionaryEnsemble(random_state=182322303);
-    
-elif classifier_string == "cboss":
-    from sktime.classification.dictionary_based import ContractableBOSS;
-    classifier = ContractableBOSS(n_jobs=parallel_threads, random_state=182322303);
-    
-    #
-    # Distance based
-    #
-elif classifier_string == "knn":
-    from sktime.classification.distance_based import KNeighborsTimeSeriesClassifier;
-    classifier = KNeighborsTimeSeriesClassifier(); #no random_state
-    
-elif classifier_string == "proxforest":
-    from sktime.classification.distance_based import ProximityForest;
-    classifier = ProximityForest(random_state=182322303);
-    
-elif classifier_string == "proxtree":
-    from sktime.classification.distance_based import ProximityTree;
-    classifier = ProximityTree(random_state=182322303);
-    
-elif classifier_string == "proxstump":
-    from sktime.classification.distance_based import ProximityStump;
-    classifier = ProximityStump(random_state=182322303);
-    
-elif classifier_string == "shapedtw":
-    from sktime.classification.distance_based import ShapeDTW;
-    classifier = ShapeDTW();#no random_state
-    # something goes wrong with the original structure
-    [X_train, X_test, y_train, myDict] = make_boring(X_train, X_test, y_train);
-    
-    #
-    # Hybrid
-    #
-elif classifier_string == "hivecote":
-    from sktime.classification.hybrid import HIVECOTEV1;
-    classifier = HIVECOTEV1();
-    
-elif classifier_string == "hivecote2":
-    from sktime.classification.hybrid import HIVECOTEV2;
-    classifier = HIVECOTEV2();
-    
-    #
-    # Interval based
-    #
-elif classifier_string == "tsf":
-    from sktime.classification.interval_based import TimeSeriesForestClassifier;
-    classifier = TimeSeriesForestClassifier(n_jobs=parallel_threads, random_state=182322303);
-    
-elif classifier_string == "cif":
-    from sktime.classification.interval_based import CanonicalIntervalForest;
-    classifier = CanonicalIntervalForest(n_jobs=parallel_threads, random_state=182322303);
-    
-    #
-    # Shapelet based
-    #
-elif classifier_string == "stc":
-    from sktime.classification.shapelet_based import ShapeletTransformClassifier;
-    classifier = ShapeletTransformClassifier(n_jobs=parallel_threads, random_state=182322303);
-    
-    #
-    # NN based
-    #
-elif classifier_string == "lstm-fcn":
-    from sktime.classification.deep_learning import LSTMFCNClassifier;
-    classifier = LSTMFCNClassifier(n_epochs=1000, random_state=182322303, verbose=0);
-    
-elif classifier_string == "cnn":
-    from sktime.classification.deep_learning.cnn import CNNClassifier;
-    classifier = CNNClassifier(n_epochs=1000, random_state=182322303, verbose=False);
-    
-    #
-    # Kernel based
-    #
-elif classifier_string == "svc":
-    from sktime.classification.kernel_based import TimeSeriesSVC;
-    classifier = TimeSeriesSVC(random_state=182322303);
-
-elif classifier_string == "arsenal":
-    from sktime.classification.kernel_based import Arsenal;
-    classifier = Arsenal(random_state=182322303);
-
-elif classifier_string == "rocket":
-    from sktime.classification.kernel_based import RocketClassifier;
-    classifier = RocketClassifier(random_state=182322303);
-    
-    #
-    # Feature based
-    #
-elif classifier_string == "catch22":
-    from sktime.classification.feature_based import Catch22Classifier;
-    from sklearn.ensemble import RandomForestClassifier;
-    classifier = Catch22Classifier(estimator=RandomForestClassifier(n_estimators=200), n_jobs=parallel_threads, random_state=182322303);
-    
-elif classifier_string == "mpc":
-    from sktime.classification.feature_based import MatrixProfileClassifier;
-    classifier = MatrixProfileClassifier(random_state=182322303);
-    
-elif classifier_string == "signature":
-    from sktime.classification.feature_based import SignatureClassifier;
-    classifier = SignatureClassifier(random_state=182322303);
-    
-elif classifier_string == "tsfresh":
-    from sktime.classification.feature_based import TSFreshClassifier;
-    classifier = TSFreshClassifier(random_state=182322303);
-    
-elif classifier_string == "tsfresh-all":
-    from sktime.classification.feature_based import TSFreshClassifier;
-    classifier = TSFreshClassifier(relevant_feature_extractor=False, random_state=182322303);
-    
-    #
-    # External (non-sktime)
-    #
-elif classifier_string == "xgboost":
-    import xgboost as xgb;
-    classifier = xgb.XGBClassifier(n_jobs=parallel_threads, random_state=182322303);
-    # unlike sktime, the structure expectation is very different
-    [X_train, X_test, y_train, myDict] = make_boring(X_train, X_test, y_train);
-#endif
+def classify(classifier_string):
+    global nested_data, shared_load_seconds;
+    if X_train is None:
+        load_start = time.perf_counter();
+        load_data();
+        shared_load_seconds += time.perf_counter() - load_start;
+    #endif
+    [classifier, boring, stopper] = make_classifier(classifier_string);
+    timings.lap("import");
+    
+    if boring:
+        [X_fit, X_pred, y_fit, classes] = make_boring(X_train, X_test, y_train);
+    elif classifier_string in nested_classifiers and isinstance(X_train, np.ndarray):
+        if nested_data is None:
+            load_start = time.perf_counter();
+            nested_data = [to_nested(X_train), to_nested(X_test)];
+            shared_load_seconds += time.perf_counter() - load_start;
+        #endif
+        [X_fit, X_pred, y_fit] = [nested_data[0], nested_data[1], y_train];
+    else:
+        [X_fit, X_pred, y_fit] = [X_train, X_test, y_train];
+    #endif
+    timings.lap("load");
+    
+    fit_start = time.perf_counter();
+    classifier.fit(X_fit, y_fit)
+    budget = budget_report(time_limit, classifier_string in contracted_classifiers or stopper is not None,
+                           time.perf_counter() - fit_start, None if stopper is None else stopper.stopped);
+    timings.lap("fit");
+    y_pred = classifier.predict(X_pred)
+    
+    # revert modifications done on classlist
+    if boring:
+        # the only revert needed is to substitute numerical indices of class identifiers with their original forms
+        y_pred = classes[np.asarray(y_pred, dtype=np.int64)];
+    #endif
+    timings.lap("predict");
+    
+    return [y_pred, budget];
+#end function
+
+def run(classifier_string):
+    # classify through the result cache when it is enabled;
+    # returns [predictions, whether they come from the cache, report of the time budget]
+    key = None;
+    if cache is not None:
+        key = cache.key([train_file, test_file], classifier_string, {"time_limit_minutes": time_limit}, 182322303);
+        record = cache.get(key);
+        timings.lap("load"); # hashing the inputs
+        if record is not None:
+            return [record["predictions"], True, record.get("budget", {})];
+        #endif
+    #endif
+    
+    before = timings.snapshot();
+    [y_pred, budget] = classify(classifier_string);
+    if key is not None:
+        after = timings.snapshot();
+        cache.put(key, {"predictions": [str(y) for y in y_pred], "budget": budget,
+                        "timings": {phase: after[phase] - before.get(phase, 0) for phase in after}});
+    #endif
+    
+    return [y_pred, False, budget];
+#end function
 
 #
 # classify
 #
 
-classifier.fit(X_train, y_train)
-y_pred = classifier.predict(X_test)
+if not batch:
+    [y_pred, cache_hit, budget] = run(classifier_strings[0]);
+    for i in range(0, len(y_pred)):
+        print(y_pred[i])
+    timings.lap("write");
+    timings.print_trailer(cache_hit, budget);
+    exit(0);
+#endif
 
-# revert modifications done on classlist
-if classifier_string == "xgboost":
-    # the only revert needed is to substitute numerical indices of class identifiers with their original forms
-    y_pred = [myDict[y] for y in y_pred];
+# batch: a failing classifier is reported and skipped, the others still run;
+# <classif_algo>.runtime and .timings hold the time of that classifier alone, without the shared load of the data
+# done by whichever classifier needed it first, the trailer holds the phases of the whole batch
+os.makedirs(output_dir, exist_ok=True);
+failed = 0;
+cache_hits = 0;
+for classifier_string in classifier_strings:
+    start = time.perf_counter();
+    shared_before = shared_load_seconds;
+    before = timings.snapshot();
+    try:
+        [y_pred, cache_hit, budget] = run(classifier_string);
+    except Exception:
+        traceback.print_exc();
+        print(classifier_string + "\tfailed", file=sys.stderr);
+        failed += 1;
+        continue;
+    #end try
+    shared = shared_load_seconds - shared_before;
+    runtime = int((time.perf_counter() - start - shared) * 1000 * 1000); # microseconds, fit + predict (the shared load is excluded)
+    after = timings.snapshot();
+    phases = {phase: after[phase] - before.get(phase, 0) for phase in after};
+    phases["load_us"] -= int(shared * 1000 * 1000);
+    cache_hits += int(cache_hit);
+    
+    with open(output_dir + classifier_string + ".txt", "w") as output:
+        output.write("\n".join(str(y) for y in y_pred) + "\n");
+    #end with
+    with open(output_dir + classifier_string + ".runtime", "w") as output:
+        output.write(str(runtime));
+    #end with
+    with open(output_dir + classifier_string + ".timings", "w") as output:
+        json.dump(dict(phases, cache_hit=cache_hit, **budget), output);
+    #end with
+    print(classifier_string + "\t" + str(runtime));
+    timings.lap("write");
+#end for
 
-for i in range(0, len(y_pred)):
-    print(y_pred[i])
+timings.print_trailer(cache_hits > 0);
+exit(1 if failed > 0 else 0);
@@ -1,7 +1,13 @@
 #!/usr/bin/python3
 
 # basic
+import timings;
+timings.reset();
 import sys;
+from threadbudget import apply_thread_budget;
+apply_thread_budget(); # before numpy, so the BLAS/OpenMP pools and torch pick up the budget
+from resultcache import open_result_cache;
+cache = open_result_cache();
 
 import warnings;
 warnings.simplefilter(action='ignore', category=FutureWarning);
@@ -48,6 +54,7 @@ if len(sys.argv) >= 4:
 else:
     slot = 0;
 
+timings.lap("import");
 matrix = np.loadtxt("data/dataset_" + str(slot) + ".txt");
 n = len(matrix);
 m = len(matrix[0]);
@@ -61,6 +68,20 @@ to_pred = int(sys.argv[2]);
 shiftval = 0.0
 
 AUTOAI_TS_RANDOM_STATE = 42
+timings.lap("load");
+
+# results of identical inputs are returned without fitting when the result cache is enabled
+cache_key = None;
+if cache is not None:
+    cache_key = cache.key(["data/dataset_" + str(slot) + ".txt"], algo, {"rows_to_predict": to_pred, "season": season}, AUTOAI_TS_RANDOM_STATE);
+    record = cache.get(cache_key);
+    if record is not None:
+        np.savetxt("data/output_" + str(slot) + ".txt", np.array(record["predictions"]), fmt='%.18f');
+        timings.lap("write");
+        timings.print_trailer(cache_hit=True);
+        exit(0);
+    #endif
+#endif
 
 #
 # prepare predictions
@@ -159,6 +180,7 @@ forecaster = TDaub(
     random_state=AUTOAI_TS_RANDOM_STATE,
 )
 
+timings.lap("import"); # the forecaster's own imports
 #
 # predict
 #
@@ -166,10 +188,18 @@ forecaster = TDaub(
 # redo in case idx_train has changed (prophet)
 y_train = pd.Series(index = idx_train, data = matrix[:, 0]);
 y_train = y_train.add(shiftval) # will be 0.0 unless HW-Multiplicative
+timings.lap("load");
 
 forecaster.fit(y_train, fh = ForecastingHorizon(np.array(range(0, to_pred), dtype=int)));
+timings.lap("fit");
 y_pred = forecaster.predict();
 
 prediction = (y_pred.to_numpy() - shiftval).reshape(to_pred); #-shift because the value is non-negative
+timings.lap("predict");
 
 np.savetxt("data/output_" + str(slot) + ".txt", prediction, fmt='%.18f');
+timings.lap("write");
+if cache_key is not None:
+    cache.put(cache_key, {"predictions": prediction.tolist(), "timings": timings.snapshot()});
+#endif
+timings.print_trailer();
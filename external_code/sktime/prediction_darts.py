@@ -1,7 +1,14 @@
 #!/usr/bin/python3
 
 # basic
+import timings;
+timings.reset();
 import sys;
+from threadbudget import apply_thread_budget;
+threads = apply_thread_budget(); # before numpy, so the BLAS/OpenMP pools pick up the budget
+jobs = {} if threads is None else {"n_jobs": threads}; # the gradient boosting libraries run their own OpenMP pools
+from resultcache import open_result_cache;
+cache = open_result_cache();
 
 import warnings;
 warnings.simplefilter(action='ignore', category=FutureWarning);
@@ -29,6 +36,7 @@ if len(sys.argv) >= 4:
 else:
     slot = 0;
 
+timings.lap("import");
 matrix = np.loadtxt("data/dataset_" + str(slot) + ".txt");
 n = len(matrix);
 m = len(matrix[0]);
@@ -37,6 +45,20 @@ algo = sys.argv[1];
 to_pred = int(sys.argv[2]);
 
 AUTOAI_TS_RANDOM_STATE = 42
+timings.lap("load");
+
+# results of identical inputs are returned without fitting when the result cache is enabled
+cache_key = None;
+if cache is not None:
+    cache_key = cache.key(["data/dataset_" + str(slot) + ".txt"], algo, {"rows_to_predict": to_pred, "season": season}, AUTOAI_TS_RANDOM_STATE);
+    record = cache.get(cache_key);
+    if record is not None:
+        np.savetxt("data/output_" + str(slot) + ".txt", np.array(record["predictions"]), fmt='%.18f');
+        timings.lap("write");
+        timings.print_trailer(cache_hit=True);
+        exit(0);
+    #endif
+#endif
 
 #
 # prepare predictions
@@ -68,11 +90,11 @@ elif algo == "nbeats-gpu":#do not use
 
 elif algo == "xgboost":
     from darts.models.forecasting.xgboost import XGBModel;
-    forecaster = XGBModel(lags=season);
+    forecaster = XGBModel(lags=season, **jobs);
 
 elif algo == "lightgbm":
     from darts.models.forecasting.lgbm import LightGBMModel;
-    forecaster = LightGBMModel(lags=season, verbose=-1);
+    forecaster = LightGBMModel(lags=season, verbose=-1, **jobs);
 
 elif algo == "lstm":
     from darts.models.forecasting.rnn_model import RNNModel;
@@ -115,14 +137,23 @@ else:
     exit(-1);
 #endif
 
+timings.lap("import"); # the forecaster's own imports
 #
 # predict
 #
 
 y_train = TimeSeries.from_values(matrix[:, 0]);
+timings.lap("load");
 forecaster.fit(y_train);
+timings.lap("fit");
 
 y_pred = forecaster.predict(n = to_pred);
 prediction = y_pred.pd_dataframe().to_numpy().reshape(to_pred);
+timings.lap("predict");
 
 np.savetxt("data/output_" + str(slot) + ".txt", prediction, fmt='%.18f');
+timings.lap("write");
+if cache_key is not None:
+    cache.put(cache_key, {"predictions": prediction.tolist(), "timings": timings.snapshot()});
+#endif
+timings.print_trailer();
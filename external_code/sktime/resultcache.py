@@ -0,0 +1,119 @@
+#!/usr/bin/python3
+
+# Opt-in, content-addressed cache of downstream results, shared by classify.py and the prediction scripts.
+# The launcher enables it with `--cache N` (N = size bound in MiB). A result is keyed by the hash of the script, the
+# content of its input files, the algorithm, its parameters and seed, and the versions of the libraries; the slot and
+# the file names are not part of the key. Entries are JSON files in CACHE_DIR, the least recently used are evicted
+# when the directory grows over the bound. A hit returns the stored predictions without fitting, the scripts report
+# it in their timings trailer (cache_hit) so timing studies can exclude it.
+
+import os;
+import sys;
+import json;
+import hashlib;
+import functools;
+import importlib.metadata;
+
+CACHE_DIR = "data/result_cache/";
+LIBRARIES = ["numpy", "pandas", "scikit-learn", "sktime", "darts", "torch", "tensorflow", "xgboost", "lightgbm",
+             "statsforecast", "prophet", "pmdarima", "tsfresh"];
+
+@functools.lru_cache(maxsize=None)
+def library_versions():
+    versions = {};
+    for library in LIBRARIES:
+        try:
+            versions[library] = importlib.metadata.version(library);
+        except importlib.metadata.PackageNotFoundError:
+            pass;
+        #end try
+    #end for
+    return versions;
+#end function
+
+def file_digest(path):
+    digest = hashlib.blake2b(digest_size=16);
+    with open(path, "rb") as file:
+        for block in iter(lambda: file.read(1 << 20), b""):
+            digest.update(block);
+        #end for
+    #end with
+    return digest.hexdigest();
+#end function
+
+class ResultCache:
+    def __init__(self, max_bytes, directory=CACHE_DIR):
+        self.max_bytes = max_bytes;
+        self.directory = directory;
+        os.makedirs(directory, exist_ok=True);
+    #end function
+
+    def key(self, input_files, algorithm, parameters, seed):
+        description = {
+            "script": file_digest(sys.argv[0]),
+            "inputs": [file_digest(path) for path in input_files],
+            "algorithm": algorithm,
+            "parameters": parameters,
+            "seed": seed,
+            "versions": library_versions(),
+        };
+        return hashlib.blake2b(json.dumps(description, sort_keys=True).encode(), digest_size=20).hexdigest();
+    #end function
+
+    def get(self, key):
+        path = self.directory + key + ".json";
+        try:
+            with open(path) as file:
+                record = json.load(file);
+            #end with
+            os.utime(path); # recently used
+        except (OSError, ValueError):
+            return None;
+        #end try
+        print("Result cache hit: " + key, file=sys.stderr);
+        return record;
+    #end function
+
+    def put(self, key, record):
+        path = self.directory + key + ".json";
+        temporary = path + "." + str(os.getpid()) + ".tmp";
+        with open(temporary, "w") as file:
+            json.dump(record, file);
+        #end with
+        os.replace(temporary, path);
+        self.evict();
+    #end function
+
+    def evict(self):
+        entries = [];
+        for entry in os.scandir(self.directory):
+            if entry.name.endswith(".json"):
+                stat = entry.stat();
+                entries.append([stat.st_mtime, stat.st_size, entry.path]);
+            #endif
+        #end for
+        total = sum(size for _, size, _ in entries);
+        for [_, size, path] in sorted(entries):
+            if total <= self.max_bytes:
+                break;
+            #endif
+            try:
+                os.remove(path);
+            except OSError:
+                pass; # evicted by another job
+            #end try
+            total -= size;
+        #end for
+    #end function
+#end class
+
+def open_result_cache():
+    # removes `--cache N` from sys.argv; returns the cache, or None if the launcher did not enable it
+    if "--cache" not in sys.argv:
+        return None;
+    #endif
+    i = sys.argv.index("--cache");
+    max_megabytes = float(sys.argv[i + 1]);
+    del sys.argv[i:i + 2];
+    return ResultCache(int(max_megabytes * 1024 * 1024));
+#end function
@@ -0,0 +1,47 @@
+#!/usr/bin/python3
+
+# Thread budget of a downstream job, shared by classify.py and the prediction scripts.
+# The launcher passes `--threads N` anywhere on the command line; the option is removed from sys.argv and N is applied
+# to the BLAS/OpenMP pools (environment for libraries loaded later, threadpoolctl for those already loaded) and to torch.
+# The scripts pass the budget to the n_jobs of their models themselves.
+
+import os;
+import sys;
+
+THREAD_VARIABLES = ["OMP_NUM_THREADS", "OPENBLAS_NUM_THREADS", "MKL_NUM_THREADS", "NUMEXPR_NUM_THREADS", "VECLIB_MAXIMUM_THREADS",
+                    "TF_NUM_INTRAOP_THREADS"];
+
+def apply_thread_budget(default=None):
+    # returns the budget, or default if the launcher did not set one (then nothing is changed)
+    if "--threads" not in sys.argv:
+        return default;
+    #endif
+    i = sys.argv.index("--threads");
+    threads = max(int(sys.argv[i + 1]), 1);
+    del sys.argv[i:i + 2];
+
+    for variable in THREAD_VARIABLES:
+        os.environ[variable] = str(threads);
+    #end for
+
+    try:
+        from threadpoolctl import threadpool_limits;
+        threadpool_limits(limits=threads);
+    except ImportError:
+        pass;
+    #end try
+
+    # once imported (e.g. by a previous job of a worker), torch and numba no longer read the environment;
+    # numba refuses a new NUMBA_NUM_THREADS after its start, but can use fewer threads than it started with
+    if "torch" in sys.modules:
+        sys.modules["torch"].set_num_threads(threads);
+    #endif
+    if "numba" in sys.modules:
+        numba = sys.modules["numba"];
+        numba.set_num_threads(min(threads, numba.config.NUMBA_NUM_THREADS));
+    else:
+        os.environ["NUMBA_NUM_THREADS"] = str(threads);
+    #endif
+
+    return threads;
+#end function
@@ -0,0 +1,65 @@
+#!/usr/bin/python3
+
+# Time budget (contract) of a downstream job. The launcher passes `--time-limit M` (minutes of training); the option is
+# removed from sys.argv. classify.py maps it onto the time_limit_in_minutes contract of the estimators that have one
+# (capped at their default ensemble size) and onto an early-stopping callback for the keras models; the other
+# estimators run unbounded and only report whether they went over the budget.
+
+import sys;
+import time;
+
+# contracts end the training when the next step would not fit in the remaining time, so a bit before the limit
+CONTRACT_TOLERANCE = 0.05;
+
+def apply_time_budget():
+    # returns the budget in minutes, or None if the launcher did not set one
+    if "--time-limit" not in sys.argv:
+        return None;
+    #endif
+    i = sys.argv.index("--time-limit");
+    minutes = float(sys.argv[i + 1]);
+    del sys.argv[i:i + 2];
+    return minutes;
+#end function
+
+def keras_time_limit(minutes):
+    # keras callback ending the training after the epoch during which the budget ran out; `stopped` tells if it did
+    from tensorflow import keras;
+
+    class TimeLimit(keras.callbacks.Callback):
+        def __init__(self):
+            super().__init__();
+            self.stopped = False;
+            self.start = time.perf_counter();
+        #end function
+
+        def on_train_begin(self, logs=None):
+            self.start = time.perf_counter();
+        #end function
+
+        def on_epoch_end(self, epoch, logs=None):
+            if time.perf_counter() - self.start >= minutes * 60:
+                self.stopped = True;
+                self.model.stop_training = True;
+            #endif
+        #end function
+    #end class
+
+    return TimeLimit();
+#end function
+
+def budget_report(minutes, enforced, fit_seconds, stopped=None):
+    # budget_hit: the callback ended the training, a contracted fit used the budget up to CONTRACT_TOLERANCE,
+    # or an unbounded fit went over the budget
+    if minutes is None:
+        return {};
+    #endif
+    if stopped is not None:
+        hit = stopped;
+    elif enforced:
+        hit = fit_seconds >= minutes * 60 * (1 - CONTRACT_TOLERANCE);
+    else:
+        hit = fit_seconds >= minutes * 60;
+    #endif
+    return {"time_limit_minutes": minutes, "budget_enforced": enforced, "budget_hit": bool(hit)};
+#end function
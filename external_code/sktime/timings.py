@@ -0,0 +1,45 @@
+#!/usr/bin/python3
+
+# Phase timings of a downstream job (import, load, fit, predict, write), measured with a monotonic clock.
+# A script calls reset() first, lap(phase) at the end of each step (the time since the previous lap is added to the
+# phase), and print_trailer() last. The trailer is the last line of stdout: `#timings {"import_us": ..., ...}`,
+# with "cache_hit" telling whether the result came from the result cache (see resultcache.py) and the report of the
+# time budget if the job had one (see timebudget.py).
+# Interpreter startup happens before the script runs and is only part of the total measured by the launcher.
+
+import json;
+import time;
+
+PHASES = ["import", "load", "fit", "predict", "write"];
+TRAILER_PREFIX = "#timings ";
+
+phases = {};
+last = time.perf_counter();
+
+def reset():
+    # a persistent worker keeps this module loaded between jobs
+    global phases, last;
+    phases = {phase: 0.0 for phase in PHASES};
+    last = time.perf_counter();
+#end function
+
+def lap(phase):
+    global last;
+    now = time.perf_counter();
+    phases[phase] = phases.get(phase, 0.0) + (now - last);
+    last = now;
+#end function
+
+def snapshot():
+    return {phase + "_us": int(seconds * 1000 * 1000) for phase, seconds in phases.items()};
+#end function
+
+def trailer(cache_hit=False, budget=None):
+    return TRAILER_PREFIX + json.dumps(dict(snapshot(), cache_hit=cache_hit, **(budget or {})));
+#end function
+
+def print_trailer(cache_hit=False, budget=None):
+    print(trailer(cache_hit, budget), flush=True);
+#end function
+
+reset();
@@ -0,0 +1,104 @@
+#!/usr/bin/python3
+
+# NumPy-native reader for the .ts files written by the test framework (ToSkTimeLine + the headers of the dataset).
+# A file is parsed into a contiguous float64 array (instances x channels x length) and a label array, both cached as
+# .npy sidecars next to the file, keyed by the hash of its content, so a file that did not change is memory-mapped
+# instead of parsed. Only equal-length files with values separated by ',' and channels by ':' are supported, the
+# rest (timestamps, unequal lengths) raises ValueError so callers can fall back to sktime's loader.
+
+import os;
+import hashlib;
+import numpy as np;
+
+CACHE_SUFFIX = ".npy";
+HASH_BLOCK = 1 << 20;
+
+def file_hash(path):
+    digest = hashlib.blake2b(digest_size=16);
+    with open(path, "rb") as file:
+        for block in iter(lambda: file.read(HASH_BLOCK), b""):
+            digest.update(block);
+        #end for
+    #end with
+    return digest.hexdigest();
+#end function
+
+def parse_ts(path):
+    with open(path, "r") as file:
+        lines = [line.strip() for line in file];
+    #end with
+
+    # headers (@...) and comments (#...) precede the data, which starts after @data
+    start = 0;
+    for i in range(0, len(lines)):
+        if lines[i].lower().startswith("@timestamps") and lines[i].split()[-1].lower() == "true":
+            raise ValueError("Timestamped .ts files are not supported: " + path);
+        if lines[i].lower() == "@data":
+            start = i + 1;
+            break;
+        #endif
+    #end for
+    lines = [line for line in lines[start:] if len(line) > 0];
+    if len(lines) == 0:
+        raise ValueError("No series found in " + path);
+    #endif
+
+    # the last ':' separates the class label, the others separate the channels
+    values, labels = zip(*[line.rpartition(":")[::2] for line in lines]);
+    channels = values[0].count(":") + 1;
+    length = values[0].count(",") // channels + 1;
+
+    # every line needs the same number of channels and every channel the same number of values,
+    # the total alone does not tell rows of unequal length apart
+    channel_values = [channel.count(",") + 1 for line in values for channel in line.split(":")];
+    if len(channel_values) != len(lines) * channels or any(count != length for count in channel_values):
+        raise ValueError("Series of unequal length or channel count in " + path);
+    #endif
+
+    text = ",".join(values).replace(":", ",").replace("?", "NaN");
+    X = np.array(text.split(","), dtype=np.float64);
+
+    return [X.reshape(len(lines), channels, length), np.array(labels)];
+#end function
+
+def load_ts(path, cache=True):
+    # returns [X, y] with X of shape (instances, channels, length); cached arrays are read-only memory maps
+    if not cache:
+        return parse_ts(path);
+    #endif
+
+    key = path + "." + file_hash(path);
+    X_file, y_file = key + ".X" + CACHE_SUFFIX, key + ".y" + CACHE_SUFFIX;
+    if os.path.exists(X_file) and os.path.exists(y_file):
+        return [np.load(X_file, mmap_mode="r"), np.load(y_file)];
+    #endif
+
+    [X, y] = parse_ts(path);
+
+    # sidecars of previous contents of the same file are stale, several slots may write concurrently
+    directory, name = os.path.split(path);
+    for entry in os.listdir(directory or "."):
+        if entry.startswith(name + ".") and entry.endswith(CACHE_SUFFIX):
+            try:
+                os.remove(os.path.join(directory, entry));
+            except OSError:
+                pass;
+            #end try
+        #endif
+    #end for
+    for [array, target] in [[X, X_file], [y, y_file]]:
+        temporary = target + "." + str(os.getpid()) + ".tmp";
+        with open(temporary, "wb") as file:
+            np.save(file, array);
+        #end with
+        os.replace(temporary, target);
+    #end for
+
+    return [np.load(X_file, mmap_mode="r"), y];
+#end function
+
+def to_nested(X):
+    # sktime's nested DataFrame (one column per channel, one pd.Series per cell), for the classifiers that need it
+    from sktime.datatypes._panel._convert import from_3d_numpy_to_nested;
+    return from_3d_numpy_to_nested(np.asarray(X));
+#end function
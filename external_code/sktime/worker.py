@@ -0,0 +1,92 @@
+#!/usr/bin/python3
+
+# Persistent downstream worker: runs classify.py, prediction.py, prediction_darts.py and prediction_AutoAI.py jobs in
+# one long-lived interpreter, so sktime, darts, torch, ... are imported once per worker instead of once per job.
+#
+# Protocol (stdin/stdout, one JSON object per line):
+#   job      -> {"script": "classify.py", "args": ["rocket", "0"]}
+#   response <- {"exit_code": 0, "stdout": "<what the script printed>", "runtime_us": <wall time of the job>}
+# The worker stops at EOF on stdin. Errors of a job are printed to stderr and reported with a non-zero exit code,
+# the worker keeps serving. The scripts are executed as __main__ with runpy, from the working directory of the worker.
+#
+# Usage: `python3 worker.py [module_to_preload ...]`, e.g. `python3 worker.py sktime darts`
+
+import io;
+import gc;
+import os;
+import sys;
+import json;
+import time;
+import runpy;
+import traceback;
+import importlib;
+import contextlib;
+
+SCRIPTS = ["classify.py", "prediction.py", "prediction_darts.py", "prediction_AutoAI.py"];
+
+def run_job(script, args):
+    if script not in SCRIPTS:
+        print("Unknown downstream script: " + str(script), file=sys.stderr);
+        return [2, ""];
+    #endif
+
+    output = io.StringIO();
+    argv = sys.argv;
+    sys.argv = [script] + [str(arg) for arg in args];
+    try:
+        with contextlib.redirect_stdout(output):
+            runpy.run_path(script, run_name="__main__");
+        #end with
+        exit_code = 0;
+    except SystemExit as e:
+        # the scripts end with exit() on errors and in batch mode
+        exit_code = e.code if isinstance(e.code, int) else (0 if e.code is None else 1);
+    except Exception:
+        traceback.print_exc();
+        exit_code = 1;
+    finally:
+        sys.argv = argv;
+    #end try
+
+    gc.collect(); # models of the job are not needed anymore
+    return [exit_code, output.getvalue()];
+#end function
+
+def serve(requests, responses):
+    for line in requests:
+        if len(line.strip()) == 0:
+            continue;
+        #endif
+        start = time.perf_counter();
+        try:
+            job = json.loads(line);
+            [exit_code, stdout] = run_job(job["script"], job.get("args", []));
+        except (ValueError, KeyError, TypeError):
+            traceback.print_exc();
+            [exit_code, stdout] = [2, ""];
+        #end try
+        runtime = (time.perf_counter() - start) * 1000 * 1000;
+
+        responses.write(json.dumps({"exit_code": exit_code, "stdout": stdout, "runtime_us": runtime}) + "\n");
+        responses.flush();
+    #end for
+#end function
+
+if __name__ == "__main__":
+    for module in sys.argv[1:]:
+        try:
+            importlib.import_module(module);
+        except ImportError:
+            print("Worker could not preload " + module, file=sys.stderr);
+        #end try
+    #end for
+
+    # the protocol gets its own copies of stdin and stdout: the exit() of the scripts closes sys.stdin,
+    # and native libraries writing to fd 1 end up on stderr instead of in the responses
+    requests = os.fdopen(os.dup(sys.stdin.fileno()), "r");
+    responses = os.fdopen(os.dup(sys.stdout.fileno()), "w");
+    sys.stdout.flush();
+    os.dup2(sys.stderr.fileno(), sys.stdout.fileno());
+
+    serve(requests, responses);
+#endif